@@ -0,0 +1,347 @@
+"""
+This script measures how the attendance pipeline in main.py scales on synthetic factory data.
+
+For every combination of employee count and number of months it generates a deterministic data set
+(employees.csv plus daily IN/OT files) and times each stage in a fresh process, recording wall time,
+peak RSS and rows/sec to a JSON results file so runs of different versions can be compared.
+
+This script contains the following functions:
+     *generate - write a synthetic employees.csv and INOUT folder
+     *runstage - run one benchmark stage and measure it
+     *benchmark - run all stages for every data size
+     *compare - print the change against an earlier results file
+     *checkshifts - check overnight pairing against the day merge on the repo's own scans
+     *checkmerge - check streamed, parallel and backend merges against the in-memory merge
+
+The generated scans follow the factory's pattern:
+    1. Day shift scans in around 08:00 and out from 17:00 with an overtime tail.
+    2. Night shift (20% of employees) scans in around 22:00 and out around 06:00 the next day.
+    3. A few employees are absent each day, some scans are missing their IN or OUT,
+       and some are duplicated a few minutes later.
+    4. Beyond 9000 employees Token IDs have more than 4 digits, which the scan terminals do not allow;
+       the data is still useful for measuring merges and reports.
+
+Example:
+    python benchmark.py --employees 1000 10000 --months 1 12 --output results.json
+    python benchmark.py --check-shifts 2021-05 --check-merge 2021-05
+"""
+import datetime as dt
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import contextlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is then not recorded
+    resource = None
+
+import main
+
+STAGES = ['scan', 'merge', 'overtime_day', 'overtime_month', 'absent_day', 'absent_month']
+START = dt.date(2021, 1, 1)  # first day of generated data
+
+
+def generate(folder, employees, months, seed=0):
+    """
+    Write employees.csv and INOUT/IN_YYYYMMDD.csv, OT_YYYYMMDD.csv files for the given number of
+    employees and months into folder. The same arguments always produce the same files.
+    :return: Returns the number of scans written.
+    :rtype: int
+    """
+    rng = np.random.default_rng(seed)
+    inout = os.path.join(folder, 'INOUT')
+    os.makedirs(inout, exist_ok=True)
+
+    ids = np.arange(1, employees + 1)
+    tokens = ids + 999
+    pd.DataFrame({'EmployeeID': [f"S{i:04d}" for i in ids],
+                  'Name': [f"Staff with ID S{i:04d}" for i in ids],
+                  'MobileNumber': rng.integers(80000000, 99999999, employees),
+                  'EMail': [f"S{i:04d}@msba.com.sg" for i in ids],
+                  'TokenID': tokens}).to_csv(os.path.join(folder, 'employees.csv'), index=False)
+    night = rng.random(employees) < 0.2
+
+    end = main.monthrange(START, (START.replace(day=1) + dt.timedelta(days=31 * (months - 1))).replace(day=1))[1]
+    total = 0
+    carry = None  # night shift scan-outs falling on the next day
+    day = START
+    while day <= end:
+        present = rng.random(employees) >= 0.05
+        scanin = np.where(night, 22 * 60, 8 * 60) + rng.normal(0, 12, employees).round()
+        scanout = np.where(night, 6 * 60, 17 * 60) + rng.exponential(60, employees).round()
+        scanin = np.clip(scanin, 0, 24 * 60 - 1).astype(np.int64)
+        scanout = np.clip(scanout, 0, 24 * 60 - 1).astype(np.int64)
+        hasin = present & (rng.random(employees) >= 0.03)
+        hasout = present & (rng.random(employees) >= 0.03)
+
+        # day shift scans of today, night shift scan-ins today and their scan-outs tomorrow
+        minutes = [scanin[hasin], scanout[hasout & ~night]]
+        scantokens = [tokens[hasin], tokens[hasout & ~night]]
+        if carry is not None:
+            minutes.append(carry[0])
+            scantokens.append(carry[1])
+        carry = (scanout[hasout & night], tokens[hasout & night])
+        minutes = np.concatenate(minutes)
+        scantokens = np.concatenate(scantokens)
+
+        duplicate = rng.random(len(minutes)) < 0.05
+        minutes = np.concatenate([minutes, np.minimum(minutes[duplicate] + rng.integers(1, 5, duplicate.sum()), 24 * 60 - 1)])
+        scantokens = np.concatenate([scantokens, scantokens[duplicate]])
+        order = np.argsort(minutes, kind='stable')
+        minutes, scantokens = minutes[order], scantokens[order]
+
+        scans = pd.DataFrame({'Date': day.isoformat(), 'Time': main.minutestotime(minutes), 'Token ID': scantokens})
+        isin = minutes < 13 * 60
+        stamp = day.strftime('%Y%m%d')
+        scans[isin].to_csv(os.path.join(inout, f"IN_{stamp}.csv"), index=False)
+        scans[~isin].to_csv(os.path.join(inout, f"OT_{stamp}.csv"), index=False)
+        total += len(scans)
+        day += dt.timedelta(days=1)
+    return total
+
+
+def peakrss():
+    """
+    Peak resident set size of this process in MB, None where the platform does not report it.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def runstage(stage, folder, months):
+    """
+    Run one stage against the data in folder and measure it. Meant to run in a fresh process so
+    the peak RSS belongs to this stage alone.
+    :return: Returns seconds, peak RSS in MB and rows processed.
+    :rtype: dict
+    """
+    os.chdir(folder)
+    last = main.monthrange(START, (START.replace(day=1) + dt.timedelta(days=31 * (months - 1))).replace(day=1))[1]
+    month = (START, main.monthrange(START, START)[1])
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        if stage == 'scan':
+            # replay the first day through the buffered scan writer into a scratch folder
+            scans = pd.concat([pd.read_csv(os.path.join('INOUT', f"{prefix}_{START:%Y%m%d}.csv"), dtype=str)
+                               for prefix in ('IN', 'OT')])
+            records = [f"{token},{date},{hhmm}" for date, hhmm, token in scans.itertuples(index=False)]
+            started = time.perf_counter()
+            rows = main.BulkScan(records, folder='SCANS')
+        elif stage == 'merge':
+            main.MergeRange(START, last)
+            rows = sum(len(main.readmg(m.year, m.month)) for m in
+                       pd.date_range(START, last, freq='MS').date)
+        elif stage == 'overtime_day':
+            main.overtimereport(START)
+            rows = len(main.loadmg(START, START))
+        elif stage == 'overtime_month':
+            rows = len(main.OverTimeRange(*month))
+        elif stage == 'absent_day':
+            main.absentreport(START)
+            rows = len(main.employeeframe())
+        elif stage == 'absent_month':
+            main.AbsentRange(*month)
+            rows = len(main.employeeframe()) * month[1].day
+        else:
+            raise ValueError(f"unknown stage {stage}")
+        seconds = time.perf_counter() - started
+    return {'seconds': round(seconds, 4), 'peak_rss_mb': peakrss(), 'rows': int(rows),
+            'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None}
+
+
+def benchmark(employees, months, stages=STAGES, seed=0, keep=None):
+    """
+    Generate data for every employees x months combination and run each stage on it in a fresh process.
+    Stages run in order, so reports see the MG files written by the merge stage.
+    :return: Returns one result per stage and data size.
+    :rtype: list
+    """
+    results = []
+    spawn = multiprocessing.get_context('spawn')
+    for employeecount in employees:
+        for monthcount in months:
+            folder = keep or tempfile.mkdtemp(prefix='attendance_bench_')
+            if keep and os.path.exists(folder):
+                shutil.rmtree(folder)
+            started = time.perf_counter()
+            scans = generate(folder, employeecount, monthcount, seed)
+            print(f"{employeecount} employees x {monthcount} months: {scans} scans generated in "
+                  f"{time.perf_counter() - started:.1f}s")
+            try:
+                for stage in stages:
+                    with spawn.Pool(1) as pool:
+                        result = pool.apply(runstage, (stage, folder, monthcount))
+                    result.update(stage=stage, employees=employeecount, months=monthcount, scans=scans)
+                    print(f"  {stage:15} {result['seconds']:9.3f}s {result['rows_per_sec'] or 0:14,.0f} rows/s"
+                          f"  peak {result['peak_rss_mb']} MB")
+                    results.append(result)
+            finally:
+                if not keep:
+                    shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline):
+    """
+    Print each stage's time relative to a baseline results file.
+    """
+    with open(baseline, 'r', encoding='utf-8') as f:
+        before = {(r['stage'], r['employees'], r['months']): r for r in json.load(f)['results']}
+    for r in results:
+        old = before.get((r['stage'], r['employees'], r['months']))
+        if old and old['seconds']:
+            print(f"{r['stage']:15} {r['employees']:>7} x {r['months']:>2}: "
+                  f"{old['seconds']:.3f}s -> {r['seconds']:.3f}s ({r['seconds'] / old['seconds']:.2f}x)")
+
+
+@contextlib.contextmanager
+def scratchcopy(source=None):
+    """
+    Work in a scratch Group_Project folder holding a copy of the repo's INOUT scans and employees.csv,
+    without any merged, indexed or converted files; the folder is removed afterwards.
+    """
+    source = source or os.path.dirname(os.path.abspath(__file__))
+    scratch = tempfile.mkdtemp(prefix='attendance_check_')
+    folder = os.path.join(scratch, 'Group_Project')
+    cwd = os.getcwd()
+    try:
+        shutil.copytree(os.path.join(source, 'INOUT'), os.path.join(folder, 'INOUT'),
+                        ignore=shutil.ignore_patterns('MG_*', '*.db*', '*.bin', '*.parquet', '.*'))
+        shutil.copy(os.path.join(source, 'employees.csv'), folder)
+        os.chdir(folder)
+        yield folder
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def checkshifts(yearmonth, source=None):
+    """
+    Merge one month of the repo's INOUT scans with day and overnight pairing in a scratch Group_Project
+    folder and check they agree. The factory's data has no night shifts, so overnight pairing must keep
+    one line per date and Token ID and give the same hours as the day merge.
+    :return: Returns the number of problems found, each one printed.
+    :rtype: int
+    """
+    start = dt.date(int(yearmonth[:4]), int(yearmonth[5:7]), 1)
+    end = main.monthrange(start, start)[1]
+    with scratchcopy(source):
+        day = main.mergerange(start, end, shifts='day')
+        night = main.mergerange(start, end, shifts='overnight')
+
+    problems = []
+    repeated = night[night.duplicated(['Date', 'Token ID'], keep=False)]
+    if len(repeated):
+        problems.append(f"{len(repeated.drop_duplicates(['Date', 'Token ID']))} (date, token) pairs "
+                        f"have more than one line, e.g.\n{repeated.head(4).to_string(index=False)}")
+    key = ['Date', 'Token ID']
+    both = day.merge(night, on=key, how='outer', suffixes=('', ' overnight'), indicator=True)
+    differ = both[(both['_merge'] != 'both') | (both['In Time'] != both['In Time overnight'])
+                  | (both['Out Time'] != both['Out Time overnight'])]
+    if len(differ):
+        problems.append(f"{len(differ)} lines differ from the day merge ({len(day)} vs {len(night)} rows), e.g.\n"
+                        f"{differ.head(4).drop(columns='_merge').to_string(index=False)}")
+    for problem in problems:
+        print(problem)
+    if not problems:
+        print(f"{yearmonth}: {len(night)} lines, overnight pairing matches the day merge")
+    return len(problems)
+
+
+def checkmerge(yearmonth, source=None):
+    """
+    Merge one month of the repo's INOUT scans every way MergeRange can and check each result against the
+    in-memory merge of the daily csv files: parallel parsing, StreamMerge within a 1 MB budget, and both
+    merges on the 'bin' and 'sqlite' backends. MG files must be byte identical, the attendance table
+    must hold the same rows.
+    :return: Returns the number of problems found, each one printed.
+    :rtype: int
+    """
+    start = dt.date(int(yearmonth[:4]), int(yearmonth[5:7]), 1)
+    end = main.monthrange(start, start)[1]
+    mgfile = f"MG_{start:%Y%m}.csv"
+    settings = {name: getattr(main, name) for name in ('BACKEND', 'MGFORMAT', 'MERGEBUDGET', 'SHIFTS')}
+    problems = []
+    with scratchcopy(source):
+        def merged(backend, merge):
+            main.BACKEND = backend
+            main.clearreports()
+            for leftover in (mgfile, main.MANIFEST):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            merge()
+            if backend == 'sqlite':
+                return main.readattendance(start, end).to_csv(index=False).encode('utf-8')
+            with open(mgfile, 'rb') as f:
+                return f.read()
+
+        try:
+            main.MGFORMAT, main.MERGEBUDGET, main.SHIFTS = 'csv', 0, 'day'
+            expected = merged('csv', lambda: main.MergeRange(start, end, workers=1))
+            variants = [('csv parallel', 'csv', lambda: main.MergeRange(start, end, workers=4)),
+                        ('csv streamed', 'csv', lambda: main.StreamMerge(start, end, budget=1))]
+            main.ConvertToBinlog()
+            variants += [('bin', 'bin', lambda: main.MergeRange(start, end)),
+                         ('bin streamed', 'bin', lambda: main.StreamMerge(start, end, budget=1))]
+            main.ImportDatabase()
+            table = main.readattendance(start, end).to_csv(index=False).encode('utf-8')
+            variants += [('sqlite', 'sqlite', lambda: main.MergeRange(start, end)),
+                         ('sqlite streamed', 'sqlite', lambda: main.StreamMerge(start, end, budget=1))]
+            for name, backend, merge in variants:
+                result = merged(backend, merge)
+                if result != (table if backend == 'sqlite' else expected):
+                    problems.append(f"{name} merge differs from the in-memory csv merge")
+            if table != main.mergescans(main.loadscans(start, end, backend='csv')).to_csv(index=False).encode('utf-8'):
+                problems.append("sqlite import differs from the in-memory csv merge")
+        finally:
+            for name, value in settings.items():
+                setattr(main, name, value)
+            main.clearreports()
+    for problem in problems:
+        print(problem)
+    if not problems:
+        print(f"{yearmonth}: {len(expected.splitlines()) - 1} lines, every merge path matches the in-memory merge")
+    return len(problems)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the attendance pipeline on synthetic data.")
+    parser.add_argument('--employees', type=int, nargs='+', default=[1000], help="employee counts, e.g. 1000 10000 100000")
+    parser.add_argument('--months', type=int, nargs='+', default=[1], help="months of scans, e.g. 1 12 24")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON results file")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    parser.add_argument('--keep', help="generate into this folder and keep it (only with one size)")
+    parser.add_argument('--check-shifts', metavar='YYYY-MM',
+                        help="only check overnight pairing against the day merge on this month of the repo's scans")
+    parser.add_argument('--check-merge', metavar='YYYY-MM',
+                        help="only check every merge path against the in-memory merge on this month of the repo's scans")
+    args = parser.parse_args()
+
+    if args.check_shifts or args.check_merge:
+        problems = checkshifts(args.check_shifts) if args.check_shifts else 0
+        problems += checkmerge(args.check_merge) if args.check_merge else 0
+        sys.exit(1 if problems else 0)
+
+    results = benchmark(args.employees, args.months, args.stages, args.seed, args.keep)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'created': dt.datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                   'platform': platform.platform(), 'backend': main.BACKEND, 'seed': args.seed,
+                   'results': results}, f, indent=1)
+    print(f"Results saved to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
@@ -6,8 +6,13 @@ Author: NTU/NBS/MSBA 2021/Group A8
 
 This script requires the following dependencies datetime, os, csv, numpy and pandas to be installed.
 This script should be run from "Group_Project" folder.
+Run it without arguments for the menu, or with an action for scheduled use, e.g.
+    python main.py merge --month 2021-05 + overtime --from 2021-05-01 --to 2021-05-31
+(see python main.py --help).
 
 This script contains the following functions: 
+     *stage - opt-in timing and counters for a block of work
+     *emitmetrics - write collected stage metrics as Prometheus text or JSON
      *menu - available program options
      *main - main function of the script 
      *inputdate - prompt user for date entry 
@@ -16,24 +21,246 @@ This script contains the following functions:
      *validtime - validate inputtime
      *inputqrcode - prompt user for Token ID
      *ScanToken - scanning and validation for each QRCode and Datetime
+     *filelock - exclusive cross-process lock for writers
+     *appendlines - crash-safe append of whole lines
+     *atomicpath - write a whole file and swap it in atomically
+     *readscans - parse a stream of (token, date, time) scan records
+     *writescans - append a batch of scans to the daily IN/OT files
+     *BulkScan - non-interactive buffered ingestion of scan records
+     *ScanServer - asyncio scan capture service for concurrent terminals
+     *BuildIndex - build the persistent (date, token) scan index
+     *lookupscan - first IN / last OUT of a token on a date from the index
+     *sendscans - terminal client for the scan capture service
      *SetTokenProfile - add in new employee information and / or update existing one
+     *employeedirectory - cached employee lookup by EmployeeID and Token ID
+     *employeeframe - deduplicated employees as a dataframe
+     *UpsertProfiles - add or update many profiles from a csv or jsonl file and compact employees.csv
      *findfiles - locate files in INOUT folder 
+     *appendbinlog - append scans to the binary scan log
+     *readbinlog - memory-map the binary scan log
+     *parsedaily - parse and deduplicate one daily IN/OT file
+     *loadscans - load all scans of a date range as integer day/minute columns
+     *mergescans - first IN / last OUT per day and token in one reduction
+     *pairshifts - pair scans into shifts across midnight on absolute minutes
+     *MergeRange - regenerate MG_YYYYMM files for every month of a date range
+     *StreamMerge - MergeRange in date ordered chunks within a memory budget
+     *MergeIncremental - refresh an MG_YYYYMM file for the days whose scans changed
+     *writemg - save a month of merged attendance as csv and/or parquet
+     *readmg - read a month of merged attendance, preferring parquet
+     *ConvertToBinlog - migrate existing IN/OT csv files into the binary scan log
+     *attendancedb - open the sqlite database of the 'sqlite' backend
+     *ImportDatabase - load existing IN/OT files and employees.csv into the database
      *MergeIOFiles - generate monthly scanning record
+     *cachedreport - LRU cache of report results keyed by input fingerprints
+     *loadmg - load merged attendance of a date range from the MG files
+     *overtime - overtime per employee and day from merged attendance
+     *OverTimeRange - overtime report with per-employee totals over a date range
      *OverTimeReport - generate overtime report based on a prompted date
+     *attendancematrix - employees x days int16 in/out/worked minutes with presence masks
+     *presencematrix - employees x days matrix of scanned days
+     *absentees - employees absent on a single day
+     *AbsentRange - absence counts and longest streaks over a date range
      *AbsentReport - generate absentee report based on a prompted date
+     *employeetotals - per employee days, worked and overtime minutes from the matrix
+     *latearrivals - scan-ins after a threshold from the matrix
+     *rollingsum - per employee sums over a rolling window of days
+     *weeklyabsence - absence rate by ISO week
+     *AnalyticsReport - HR analytics over a date range
+     *importtimes - startup and first-use import times
+     *cli - run actions from the command line without the menu
 
 This script assumes following:
     1. An existing "employees.csv" file stored in "Group_Project" folder. 
     2. QR code comprises of 4 digits only.
     3. Employee ID starts with S followed by 4 digits. 
     4. This script does not validate the completeness of employee email address.
+    5. Scans are stored as daily IN/OT csv files unless ATTENDANCE_BACKEND=bin is set,
+       in which case they are appended to the binary scan log "INOUT/scans.bin".
+       ATTENDANCE_BACKEND=sqlite keeps scans, employees and merged attendance in "attendance.db"
+       instead; "database" on the command line imports the existing files into it.
+    6. ATTENDANCE_WORKERS sets how many processes parse daily files during a merge (1, serial, by default).
+    7. ATTENDANCE_MG_FORMAT=parquet (or both) writes typed MG_YYYYMM.parquet files, which the reports
+       prefer over MG_YYYYMM.csv. This needs pyarrow; without it MG files stay csv.
+    8. pandas, numpy and pyarrow are imported on first use, so scanning tokens and the menu only need the
+       standard library; "--time" on the command line reports the import times.
+    9. ATTENDANCE_METRICS (or "--metrics") turns on stage timings and counters: 'log' prints a JSON line
+       per stage on stderr, a path ending in .prom gets Prometheus text and any other path JSON at exit.
+    10. "INOUT/scanindex.db", once built with "index --build", holds the first IN and last OUT of every
+        token and day; every scan updates it and single day reports read from it.
+    11. ATTENDANCE_SHIFTS=overnight (or "merge --shifts overnight") pairs scans across midnight for night
+        shifts, dating each line by its scan-in; by default a line is the first IN and last OUT of a date.
+    12. ATTENDANCE_MERGE_BUDGET (or "merge --budget") in MB streams merges in date order within that much
+        memory for scans, writing each month as it completes; 0 (the default) loads the whole range at once.
+    13. Report results are cached until their MG files, employees or database change: ATTENDANCE_CACHE_SIZE
+        reports (32 by default, 0 for none) in memory, and on disk in ATTENDANCE_CACHE_DIR when set.
 
 """
+import time
+STARTED = time.perf_counter()  # start of this script's own import, see importtimes
 import datetime as dt
-import pandas as pd
-import numpy as np
 import os
 import csv
+import sys
+import struct
+import json
+import argparse
+import atexit
+import contextlib
+import threading
+import queue
+import hashlib
+import collections
+try:
+    import fcntl
+except ImportError:  # Windows locks files through msvcrt instead
+    fcntl = None
+    import msvcrt
+import importlib
+import importlib.util
+
+
+class LazyModule:
+    """
+    Stand-in for a heavy module (pandas, numpy, pyarrow, asyncio, sqlite3) that is only imported on first use,
+    so scanning and the menu start without loading them. The real module then replaces the
+    stand-in under its global name and the import time is kept in IMPORTTIMES.
+    """
+    def __init__(self, name, alias):
+        self.__dict__.update(_name=name, _alias=alias)
+
+    def __getattr__(self, attr):
+        started = time.perf_counter()
+        module = importlib.import_module(self._name)
+        IMPORTTIMES[self._name] = time.perf_counter() - started
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+
+IMPORTTIMES = {}  # seconds spent importing, per module
+pd = LazyModule('pandas', 'pd')
+np = LazyModule('numpy', 'np')
+pa = LazyModule('pyarrow', 'pa')
+pq = LazyModule('pyarrow.parquet', 'pq')
+asyncio = LazyModule('asyncio', 'asyncio')  # only the scan capture service needs it
+sqlite3 = LazyModule('sqlite3', 'sqlite3')  # only the 'sqlite' backend and the scan index need it
+HASPARQUET = importlib.util.find_spec('pyarrow') is not None  # parquet MG files are optional
+METRICS = os.environ.get('ATTENDANCE_METRICS')  # None (off), 'log', or a .prom / .json file written at exit
+STATS = {}  # per stage totals, see stage
+
+
+class Stage:
+    """
+    Times one stage of work (file listing, parse, reduce, write, ...) and adds its counters
+    to STATS when it ends. With METRICS set to 'log' every stage is also printed as a JSON line on stderr.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.counts = {'rows_in': 0, 'rows_out': 0, 'files': 0, 'bytes': 0}
+
+    def count(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] += int(value)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.started
+        total = STATS.setdefault(self.name, {'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0, 'files': 0, 'bytes': 0})
+        total['calls'] += 1
+        total['seconds'] += seconds
+        for key, value in self.counts.items():
+            total[key] += value
+        if METRICS == 'log':
+            print(json.dumps({'stage': self.name, 'seconds': round(seconds, 6), **self.counts}), file=sys.stderr)
+        return False
+
+
+class NoStage:
+    """
+    Shared do-nothing stage handed out while instrumentation is off.
+    """
+    def count(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOSTAGE = NoStage()
+
+
+def stage(name):
+    """
+    Instrument a block of work: with stage('merge.parse') as s: ... s.count(rows_in=n)
+    """
+    return Stage(name) if METRICS else NOSTAGE
+
+
+def emitmetrics(target=None):
+    """
+    Write the collected stage totals to a Prometheus text file (.prom) or a JSON file.
+    """
+    target = target or METRICS
+    if not target or target == 'log' or not STATS:
+        return
+    if target.endswith('.prom'):
+        lines = []
+        for key, help in [('seconds', 'Seconds spent in the stage'), ('calls', 'Times the stage ran'),
+                          ('rows_in', 'Rows going into the stage'), ('rows_out', 'Rows coming out of the stage'),
+                          ('files', 'Files touched by the stage'), ('bytes', 'Bytes read by the stage')]:
+            lines.append(f"# HELP attendance_stage_{key} {help} during the last run")
+            lines.append(f"# TYPE attendance_stage_{key} gauge")
+            lines += [f'attendance_stage_{key}{{stage="{name}"}} {totals[key]}' for name, totals in sorted(STATS.items())]
+        text = '\n'.join(lines) + '\n'
+    else:
+        text = json.dumps({'created': dt.datetime.now().isoformat(timespec='seconds'), 'stages': STATS}, indent=1)
+    with open(target + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(target + '.tmp', target)
+
+
+def enablemetrics(target):
+    """
+    Turn instrumentation on, target is 'log' or the .prom / .json file written when the process exits.
+    """
+    global METRICS
+    METRICS = target
+    if target != 'log':
+        atexit.register(emitmetrics, target)
+
+
+if METRICS:
+    enablemetrics(METRICS)
+
+BACKEND = os.environ.get('ATTENDANCE_BACKEND', 'csv')  # 'csv' daily files, 'bin' scan log or 'sqlite' database
+DATABASE = 'attendance.db'  # sqlite database of the 'sqlite' backend, kept next to the INOUT folder
+DBCONNECTIONS = threading.local()  # open connections to DATABASE of each thread, see attendancedb
+DBSCHEMA = set()  # (database path, process id) whose tables have been created
+BINLOG = 'scans.bin'  # binary scan log, kept inside the INOUT folder
+EPOCH = dt.date(1970, 1, 1)  # day numbers in the scan log count from here
+SCANRECORD = struct.Struct('<HHH')  # day number, minutes since midnight, Token ID
+WORKERS = int(os.environ.get('ATTENDANCE_WORKERS', '1'))  # processes used to parse daily files
+PARALLELMIN = 32  # below this many daily files parsing stays serial
+MGFORMAT = os.environ.get('ATTENDANCE_MG_FORMAT', 'csv')  # MG files as 'csv', 'parquet' or 'both'
+MERGEBUDGET = int(os.environ.get('ATTENDANCE_MERGE_BUDGET', '0'))  # MB of scans held at once while merging, 0 loads all
+SCANROWBYTES = 100  # memory of one parsed scan row, used to size chunks within MERGEBUDGET
+SHIFTS = os.environ.get('ATTENDANCE_SHIFTS', 'day')  # 'day' pairs scans within a date, 'overnight' across midnight
+SHIFTMAX = 16 * 60  # longest span in minutes from scan-in to scan-out paired as one shift
+BURST = 30  # repeated IN (or OT) scans of a token within this many minutes count as one scan
+SCANINDEX = 'scanindex.db'  # (date, token) -> first IN / last OUT index, kept inside the INOUT folder
+SCANPORT = 8765  # default port of the scan capture service
+MANIFEST = 'mg_manifest.json'  # daily file signatures behind each MG file, kept next to the MG files
+CACHESIZE = int(os.environ.get('ATTENDANCE_CACHE_SIZE', '32'))  # reports kept in the report cache, 0 turns it off
+CACHEDIR = os.environ.get('ATTENDANCE_CACHE_DIR')  # folder also holding cached reports across runs, None for memory only
+REPORTS = collections.OrderedDict()  # in-process report cache, least recently used first, see cachedreport
+EMPLOYEECOLUMNS = ['EmployeeID', 'Name', 'MobileNumber', 'EMail', 'TokenID']
+DIRECTORY = {}  # cached employee directory, see employeedirectory
+HELDLOCKS = threading.local()  # lock files held by each thread and how many times, see filelock
 
 # Part 03 of Project
 def menu():
@@ -178,9 +405,6 @@ def ScanToken():
             os.makedirs(".\INOUT")  # If INOUT folder does not exist create INOUT
 
     while True:
-        qrcodes = []
-        qrtimes = []
-        qrdates = []
         qrcode = inputqrcode()
         if qrcode != 'Q':
             qryear, qrmonth, qrday = inputdate()
@@ -188,47 +412,571 @@ def ScanToken():
         else:
             break
 
-        qrcodes.append(qrcode)
-        qrdates.append(dt.date(qryear, qrmonth, qrday))
-        qrtimes.append(dt.time(qrhour, qrmin))
-
-        data = {'Date': qrdates, 'Time': qrtimes, 'Token ID': qrcodes}
-        df = pd.DataFrame(data)
-        df1 = df.copy()
-        df1['Date'] = pd.to_datetime(df1['Date'])
-        df1["Date"].dt.strftime("%y/%m/%d")
-        df1["Year"] = df1['Date'].dt.year
-        min_year = df1["Year"].max()
-        max_year = df1["Year"].min()
-        df1["Month"] = df1['Date'].dt.month
-        df1["Day"] = df1['Date'].dt.day
-        df1['Hour'] = df1['Time'].apply(lambda x: x.hour)
-
         # As Part 06 of Project
-        for year in range(min_year, max_year + 1):
-            for month in range(1, 13):
-                for day in range(1, 32):
-                    df2 = df1[(df1["Year"] == year) & (df1["Month"] == month) & (df1["Day"] == day) & (df1["Hour"] < 13)]
-                    if len(df2) != 0: #write csv files only for dates with scanning entries                       
-                        df2 = df2.drop(["Year", "Month", "Day", "Hour"], axis=1)
-                        df2["Time"] = df2["Time"].map(lambda t: t.strftime('%H:%M'))
-                        fname = f"INOUT\\IN_{str(year).zfill(4)}{str(month).zfill(2)}{str(day).zfill(2)}.csv"
-                        # append new entries in case the file for a day with existing record
-                        if os.path.exists(fname):
-                            df2.to_csv(fname, mode='a', header=False, encoding="utf-8", index=False)
-                        else:
-                            df2.to_csv(fname, encoding='utf-8', index=False)
-
-                    df3 = df1[(df1["Year"] == year) & (df1["Month"] == month) & (df1["Day"] == day) & (df1["Hour"] >= 13)]
-                    if len(df3) != 0:#write csv files only for dates with scanning entries
-                        df3 = df3.drop(["Year", "Month", "Day", "Hour"], axis=1)
-                        df3["Time"] = df3["Time"].map(lambda t: t.strftime('%H:%M'))
-                        fname = f"INOUT\OT_{str(year).zfill(4)}{str(month).zfill(2)}{str(day).zfill(2)}.csv"
-                        # append new entries in case the file for a day with existing record
-                        if os.path.exists(fname):
-                            df3.to_csv(fname, mode='a', header=False, encoding="utf-8", index=False)
-                        else:
-                            df3.to_csv(fname, encoding='utf-8', index=False)
+        writescans([(qrcode, dt.date(qryear, qrmonth, qrday), dt.time(qrhour, qrmin))])
+
+
+@contextlib.contextmanager
+def filelock(path):
+    """
+    Hold an exclusive lock on path + '.lock' so writers in other processes wait their turn.
+    The lock is reentrant within a thread; other threads of this process wait like other processes do.
+    """
+    lockname = os.path.abspath(path + '.lock')
+    held = HELDLOCKS.__dict__.setdefault('counts', {})
+    if lockname in held:
+        held[lockname] += 1
+        try:
+            yield
+        finally:
+            held[lockname] -= 1
+        return
+
+    folder = os.path.dirname(lockname)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(lockname, 'a+') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        else:
+            lock.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)  # gives up after 10 attempts
+                    break
+                except OSError:
+                    pass
+        held[lockname] = 1
+        try:
+            yield
+        finally:
+            del held[lockname]
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+            else:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def appendlines(path, header, lines):
+    """
+    Append complete lines to a text file in one write and flush them to disk. The caller holds the lock.
+    The header goes in first when the file is new or empty, and a line cut short by a crash is ended
+    first so the new rows do not run into it.
+    """
+    data = ''.join(lines)
+    with open(path, 'a+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            data = header + data
+        else:
+            f.seek(size - 1)
+            if f.read(1) != b'\n':
+                data = '\n' + data
+        f.write(data.encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+@contextlib.contextmanager
+def atomicpath(path):
+    """
+    Give a temporary path to write a whole file to; once written it replaces path in one step,
+    so readers see either the old or the new file and never a partly written one.
+    """
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp
+        with open(tmp, 'r+b') as f:  # fsync needs a writable handle on Windows
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def scanfile(date, hour, folder='INOUT'):
+    '''
+    Return the daily file a scan belongs to, IN file before 1pm and OT file from 1pm onwards.
+    '''
+    prefix = 'IN' if hour < 13 else 'OT'
+    return os.path.join(folder, f"{prefix}_{date.strftime('%Y%m%d')}.csv")
+
+
+def readscans(source):
+    '''
+    Parse scan records from a file name, an open file or an iterable.
+    Lines are "Token ID,YYYY-MM-DD,HH:MM"; tuples may already hold date/time objects.
+    Invalid records are reported and skipped so a bad line does not stop the stream.
+    '''
+    if isinstance(source, str):
+        with open(source, 'r', encoding='utf-8') as f:
+            yield from readscans(f)
+        return
+
+    for lineno, record in enumerate(source, start=1):
+        if isinstance(record, str):
+            record = record.strip()
+            if not record or record.startswith('#'):
+                continue
+        try:
+            yield parsescan(record)
+        except ValueError as error:
+            print(f"Line {lineno}: {error}, skipped")
+
+
+def parsescan(record):
+    '''
+    Validate one scan record, a "Token ID,YYYY-MM-DD,HH:MM" line or a (token, date, time) tuple.
+    :return: Returns the (token, date, time) tuple with date and time objects.
+    :rtype: tuple
+    :raises ValueError: with the reason when the record is not valid.
+    '''
+    if isinstance(record, str):
+        record = [field.strip() for field in record.split(',')]
+    try:
+        qrcode, qrdate, qrtime = record
+    except ValueError:
+        raise ValueError("expected 3 fields") from None
+    qrcode = str(qrcode)
+    if isinstance(qrdate, str):
+        if len(qrdate) != 10 or not validdate(qrdate[0:4], qrdate[5:7], qrdate[8:]):
+            raise ValueError(f"invalid date {qrdate}")
+        qrdate = dt.date(int(qrdate[0:4]), int(qrdate[5:7]), int(qrdate[8:]))
+    if isinstance(qrtime, str):
+        if len(qrtime) != 5 or qrtime[2:3] != ':' or not validtime(qrtime[0:2], qrtime[3:]):
+            raise ValueError(f"invalid time {qrtime}")
+        qrtime = dt.time(int(qrtime[0:2]), int(qrtime[3:]))
+    if not qrcode.isdigit() or len(qrcode) != 4:
+        raise ValueError(f"invalid Token ID {qrcode}")
+    return qrcode, qrdate, qrtime
+
+
+def writescans(records, folder='INOUT'):
+    '''
+    Append (token, date, time) records to the daily IN/OT files, or to the scan log for the 'bin' backend.
+    Records are grouped per file in one pass and committed together under the folder's lock,
+    with one write per file, so concurrent writers never interleave rows or duplicate headers.
+    The scan index, when it has been built, is updated after the scans are stored and under the same lock.
+    :return: Returns the number of records written.
+    :rtype: int
+    '''
+    records = list(records)
+    groups = {}
+    if BACKEND == 'csv':
+        for qrcode, qrdate, qrtime in records:
+            fname = scanfile(qrdate, qrtime.hour, folder)
+            groups.setdefault(fname, []).append(f"{qrdate.isoformat()},{qrtime.strftime('%H:%M')},{qrcode}\n")
+    if not records:
+        return 0
+
+    with filelock(os.path.join(folder, '.scans')):
+        if BACKEND == 'bin':
+            count = appendbinlog(records, os.path.join(folder, BINLOG))
+        elif BACKEND == 'sqlite':
+            count = insertscans(records, folder)
+        else:
+            count = 0
+            with stage('scan.write') as s:
+                for fname, lines in groups.items():
+                    appendlines(fname, 'Date,Time,Token ID\n', lines)
+                    count += len(lines)
+                s.count(rows_out=count, files=len(groups))
+        if os.path.exists(os.path.join(folder, SCANINDEX)):
+            updateindex(records, folder)
+    return count
+
+
+def BulkScan(source=None, flushsize=1000, flushinterval=5.0, folder='INOUT'):
+    '''
+    Non-interactive scan ingestion for turnstile feeds.
+    Records from source (stdin when not given) are buffered and flushed to the daily IN/OT files
+    once flushsize records are pending or flushinterval seconds have passed since the last flush,
+    also while the feed is idle.
+    :return: Returns the number of records written.
+    :rtype: int
+    '''
+    if not 0 < flushinterval < float('inf'):
+        raise ValueError(f"flushinterval must be a number of seconds above 0, not {flushinterval}")
+    if source is None:
+        source = sys.stdin
+
+    # records are read in a thread so a quiet feed is still flushed every flushinterval seconds
+    pending = queue.Queue(maxsize=max(flushsize, 1) * 2)
+    finished = object()
+    def read():
+        try:
+            for record in readscans(source):
+                pending.put(record)
+            pending.put(finished)
+        except Exception as error:
+            pending.put(error)
+    threading.Thread(target=read, name='BulkScan reader', daemon=True).start()
+
+    buffer = []
+    total = 0
+    lastflush = time.monotonic()
+    while True:
+        try:
+            record = pending.get(timeout=max(0.0, lastflush + flushinterval - time.monotonic()))
+        except queue.Empty:
+            record = None
+        if record is finished:
+            break
+        if isinstance(record, Exception):
+            writescans(buffer, folder)
+            raise record
+        if record is not None:
+            buffer.append(record)
+        if len(buffer) >= flushsize or time.monotonic() - lastflush >= flushinterval:
+            total += writescans(buffer, folder)
+            buffer = []
+            lastflush = time.monotonic()
+    total += writescans(buffer, folder)
+    return total
+
+
+async def handlescans(reader, writer, queue):
+    '''
+    Serve one terminal connection. Each line is "Token ID,YYYY-MM-DD,HH:MM" or just "Token ID" for
+    the current time, and is answered with "OK" once the scan is written or "ERR <reason>".
+    '''
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            text = line.decode('utf-8', 'replace').strip()
+            if not text:
+                continue
+            try:
+                if ',' not in text:
+                    now = dt.datetime.now()
+                    text = f"{text},{now:%Y-%m-%d},{now:%H:%M}"
+                record = parsescan(text)
+                if findtoken(record[0]) is None:
+                    raise ValueError(f"unknown Token ID {record[0]}")
+                done = loop.create_future()
+                await queue.put((record, done))  # waits while the writer is behind, so the terminal slows down
+                await done
+                reply = "OK"
+            except ValueError as error:
+                reply = f"ERR {error}"
+            except Exception as error:
+                reply = f"ERR not written: {error}"
+            writer.write(f"{reply}\n".encode('utf-8'))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def scanwriter(queue, folder='INOUT', batchsize=1000):
+    '''
+    The single task writing scans: takes everything queued (up to batchsize) and writes it as one batch
+    through writescans in a worker thread, then releases the waiting terminals.
+    '''
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        while len(batch) < batchsize and not queue.empty():
+            batch.append(queue.get_nowait())
+        try:
+            await loop.run_in_executor(None, writescans, [record for record, done in batch], folder)
+        except Exception as error:  # a failed batch is reported to its terminals, the writer carries on
+            for record, done in batch:
+                if not done.done():
+                    done.set_exception(error)
+        else:
+            for record, done in batch:
+                if not done.done():
+                    done.set_result(True)
+        for _ in batch:
+            queue.task_done()
+
+
+async def startscanserver(host='127.0.0.1', port=SCANPORT, path=None, folder='INOUT', queuesize=10000, batchsize=1000):
+    '''
+    Start the scan capture service on a TCP port, or on a Unix socket when path is given.
+    :return: Returns the server, its queue and the writer task, to be passed to stopscanserver.
+    :rtype: tuple
+    '''
+    queue = asyncio.Queue(maxsize=queuesize)
+    writertask = asyncio.create_task(scanwriter(queue, folder, batchsize))
+    def handler(reader, writer):
+        return handlescans(reader, writer, queue)
+    if path:
+        server = await asyncio.start_unix_server(handler, path=path)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+    return server, queue, writertask
+
+
+async def stopscanserver(server, queue, writertask):
+    '''
+    Stop accepting connections, write every scan already accepted and stop the writer.
+    '''
+    server.close()
+    await server.wait_closed()
+    await queue.join()
+    writertask.cancel()
+
+
+async def servescans(host='127.0.0.1', port=SCANPORT, path=None, folder='INOUT', queuesize=10000, batchsize=1000):
+    '''
+    Run the scan capture service until it is interrupted.
+    '''
+    server, queue, writertask = await startscanserver(host, port, path, folder, queuesize, batchsize)
+    print(f"Accepting scans on {path or f'{host}:{port}'}")
+    try:
+        await server.serve_forever()
+    finally:
+        await stopscanserver(server, queue, writertask)
+
+
+def ScanServer(host='127.0.0.1', port=SCANPORT, path=None, folder='INOUT'):
+    '''
+    Scan capture service for many gates at once, tokens are checked against employees.csv.
+    '''
+    try:
+        asyncio.run(servescans(host, port, path, folder))
+    except KeyboardInterrupt:
+        print("Scan capture stopped")
+
+
+async def sendscans(lines, host='127.0.0.1', port=SCANPORT, path=None):
+    '''
+    Minimal terminal client: send scan lines to the capture service and collect its replies.
+    '''
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    replies = []
+    for line in lines:
+        writer.write(line.strip().encode('utf-8') + b'\n')
+        await writer.drain()
+        replies.append((await reader.readline()).decode('utf-8').strip())
+    writer.close()
+    await writer.wait_closed()
+    return replies
+
+
+
+def indexdb(folder='INOUT', name=SCANINDEX):
+    '''
+    Open the scan index, a stdlib sqlite table of first scan-in and last scan-out minutes keyed by
+    (day number, Token ID).
+    '''
+    db = sqlite3.connect(os.path.join(folder, name), timeout=30)
+    db.execute("""CREATE TABLE IF NOT EXISTS scanindex (
+                      day INTEGER NOT NULL, token INTEGER NOT NULL, first_in INTEGER, last_out INTEGER,
+                      PRIMARY KEY (day, token)) WITHOUT ROWID""")
+    return db
+
+
+def updateindex(records, folder='INOUT'):
+    '''
+    Fold (token, date, time) records into the scan index, scans before 1pm count as IN like in scanfile.
+    '''
+    rows = []
+    for qrcode, qrdate, qrtime in records:
+        minute = qrtime.hour * 60 + qrtime.minute
+        isin = qrtime.hour < 13
+        rows.append(((qrdate - EPOCH).days, int(qrcode), minute if isin else None, None if isin else minute))
+    with contextlib.closing(indexdb(folder)) as db, db:
+        db.executemany("""INSERT INTO scanindex (day, token, first_in, last_out) VALUES (?, ?, ?, ?)
+                          ON CONFLICT (day, token) DO UPDATE SET
+                          first_in = min(coalesce(first_in, excluded.first_in), coalesce(excluded.first_in, first_in)),
+                          last_out = max(coalesce(last_out, excluded.last_out), coalesce(excluded.last_out, last_out))""",
+                       rows)
+
+
+def BuildIndex(folder='INOUT'):
+    '''
+    Build the scan index from every scan already stored (daily files or scan log).
+    Once it exists writescans keeps it current, and single day reports read from it.
+    :return: Returns the number of (date, token) entries.
+    :rtype: int
+    '''
+    with filelock(os.path.join(folder, '.scans')):
+        scans = loadscans(EPOCH, dt.date(2149, 6, 1), folder)
+        reduced = scans.groupby(['Day', 'Token ID', 'IN'])['Minute'].agg(['min', 'max']).reset_index()
+        firstin = reduced[reduced['IN']].set_index(['Day', 'Token ID'])['min'].rename('first_in')
+        lastout = reduced[~reduced['IN']].set_index(['Day', 'Token ID'])['max'].rename('last_out')
+        entries = pd.concat([firstin, lastout], axis=1).reset_index()
+        rows = [(int(day), int(token), None if pd.isna(first) else int(first), None if pd.isna(last) else int(last))
+                for day, token, first, last in entries.itertuples(index=False)]
+
+        # built aside and swapped in, so lookups keep reading the old index until the new one is complete
+        building = SCANINDEX + '.tmp'
+        if os.path.exists(os.path.join(folder, building)):
+            os.remove(os.path.join(folder, building))
+        with contextlib.closing(indexdb(folder, building)) as db, db:
+            db.executemany("INSERT INTO scanindex VALUES (?, ?, ?, ?)", rows)
+        os.replace(os.path.join(folder, building), os.path.join(folder, SCANINDEX))
+    return len(rows)
+
+
+def lookupscan(tokenID, date, folder='INOUT'):
+    '''
+    When did a token scan in and out on a date, as HH:MM strings (None when there is no such scan).
+    '''
+    with contextlib.closing(indexdb(folder)) as db:
+        row = db.execute("SELECT first_in, last_out FROM scanindex WHERE day = ? AND token = ?",
+                         ((date - EPOCH).days, int(tokenID))).fetchone()
+    if row is None:
+        return None, None
+    return tuple(None if m is None else f"{m // 60:02d}:{m % 60:02d}" for m in row)
+
+
+def indexday(date, folder='INOUT'):
+    '''
+    Merged attendance of one day straight from the scan index, laid out like MG_YYYYMM.csv
+    with the same defaults for missing scans as MergeIOFiles.
+    '''
+    with stage('report.index') as s, contextlib.closing(indexdb(folder)) as db:
+        rows = db.execute("SELECT token, first_in, last_out FROM scanindex WHERE day = ? ORDER BY token",
+                          ((date - EPOCH).days,)).fetchall()
+        s.count(rows_out=len(rows), files=1)
+    timein = np.array([12 * 60 + 59 if first is None else first for token, first, last in rows], dtype=np.int64)
+    timeout = np.array([14 * 60 if last is None else last for token, first, last in rows], dtype=np.int64)
+    duration = timeout - timein
+    m = pd.DataFrame({'Date': str(date), 'In Time': minutestotime(timein), 'Out Time': minutestotime(timeout),
+                      'Token ID': np.array([row[0] for row in rows], dtype=np.int64),
+                      'Hrs': duration // 60, 'Mins': duration % 60})
+    return m.sort_values(['Date', 'In Time', 'Out Time', 'Token ID']).reset_index(drop=True)
+
+
+
+def attendancedb(folder='INOUT'):
+    '''
+    The database of the 'sqlite' backend, next to the INOUT folder, in WAL mode so reports can read
+    while scans are written. The scans, employees and attendance tables and their indexes are created
+    the first time a process opens it; the connection is then kept for reuse by the same thread.
+    Use it as a context manager (with attendancedb() as db:) for a transaction, never close it.
+    '''
+    path = os.path.join(os.path.dirname(os.path.abspath(folder)), DATABASE)
+    connections = DBCONNECTIONS.__dict__.setdefault('bypath', {})
+    pid, db = connections.get(path, (None, None))
+    exists = os.path.exists(path)
+    if db is not None and pid == os.getpid() and exists:
+        return db
+    if db is not None and pid == os.getpid():
+        db.close()  # the database was removed, start a new one
+
+    db = sqlite3.connect(path, timeout=30)
+    db.execute("PRAGMA synchronous=NORMAL")
+    if not exists or (path, os.getpid()) not in DBSCHEMA:
+        db.execute("PRAGMA journal_mode=WAL")  # kept in the database file, connections opened later inherit it
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS scans (day INTEGER NOT NULL, minute INTEGER NOT NULL, token INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS scans_day_token ON scans (day, token);
+            CREATE TABLE IF NOT EXISTS employees (employee_id TEXT PRIMARY KEY, name TEXT, mobile TEXT, email TEXT,
+                                                  token INTEGER);
+            CREATE INDEX IF NOT EXISTS employees_token ON employees (token);
+            CREATE TABLE IF NOT EXISTS attendance (day INTEGER NOT NULL, token INTEGER NOT NULL,
+                                                   in_minute INTEGER NOT NULL, out_minute INTEGER NOT NULL,
+                                                   minutes INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS attendance_day_token ON attendance (day, token);
+        """)
+        DBSCHEMA.add((path, os.getpid()))
+    connections[path] = (os.getpid(), db)
+    return db
+
+
+def insertscans(records, folder='INOUT'):
+    '''
+    Insert (token, date, time) records into the scans table in one transaction.
+    :return: Returns the number of records written.
+    :rtype: int
+    '''
+    rows = [((qrdate - EPOCH).days, qrtime.hour * 60 + qrtime.minute, int(qrcode)) for qrcode, qrdate, qrtime in records]
+    with stage('scan.write') as s, attendancedb(folder) as db:
+        db.executemany("INSERT INTO scans (day, minute, token) VALUES (?, ?, ?)", rows)
+        s.count(rows_in=len(rows), rows_out=len(rows))
+    return len(rows)
+
+
+def sqlscans(day0, day1, days, allscans, folder='INOUT'):
+    '''
+    loadscans for the 'sqlite' backend: the first IN and last OUT per day and token (or every scan with allscans)
+    are selected on the (day, token) index.
+    '''
+    where = "day BETWEEN ? AND ?"
+    params = [day0, day1]
+    if days is not None:
+        where += f" AND day IN ({','.join('?' * len(days))})"
+        params += sorted(days)
+    if allscans:
+        query = f"SELECT day, minute, token, minute < 780 FROM scans WHERE {where}"
+    else:
+        query = (f"SELECT day, min(minute), token, 1 FROM scans WHERE {where} AND minute < 780 GROUP BY day, token "
+                 f"UNION ALL SELECT day, max(minute), token, 0 FROM scans WHERE {where} AND minute >= 780 GROUP BY day, token")
+        params = params * 2
+    with stage('merge.parse') as s:
+        rows = attendancedb(folder).execute(query, params).fetchall()
+        s.count(files=1, rows_out=len(rows))
+    scans = pd.DataFrame(rows, columns=['Day', 'Minute', 'Token ID', 'IN'], dtype=np.int64)
+    return scans.astype({'IN': bool})
+
+
+def saveattendance(mg, year, month):
+    '''
+    savemg for the 'sqlite' backend: replace the month's rows of the attendance table.
+    '''
+    first, last = monthrange(dt.date(year, month, 1), dt.date(year, month, 1))
+    with attendancedb() as db:
+        db.execute("DELETE FROM attendance WHERE day BETWEEN ? AND ?", ((first - EPOCH).days, (last - EPOCH).days))
+        db.executemany("INSERT INTO attendance VALUES (?, ?, ?, ?, ?)", attendancerows(mg))
+    return [f"MG_{year}{str(month).zfill(2)} in {DATABASE}"]
+
+
+def attendancerows(mg):
+    '''
+    Rows of the attendance table for merged attendance laid out like MG_YYYYMM.csv.
+    '''
+    days = (pd.to_datetime(mg['Date'], format='%Y-%m-%d') - pd.Timestamp(EPOCH)).dt.days
+    return zip(days.tolist(), mg['Token ID'].tolist(), timetominutes(mg['In Time']).tolist(),
+               timetominutes(mg['Out Time']).tolist(), (mg['Hrs'] * 60 + mg['Mins']).tolist())
+
+
+def readattendance(start, end):
+    '''
+    Merged attendance between start and end (inclusive) from the attendance table, laid out like MG_YYYYMM.csv.
+    '''
+    rows = attendancedb().execute("SELECT day, token, in_minute, out_minute, minutes FROM attendance WHERE day BETWEEN ? AND ?",
+                                  ((start - EPOCH).days, (end - EPOCH).days)).fetchall()
+    m = pd.DataFrame(rows, columns=['Day', 'Token ID', 'In', 'Out', 'Minutes'], dtype=np.int64)
+    return formatmg(m, m['In'], m['Out'], m['Minutes'])
+
+
+def ImportDatabase(folder='INOUT', csvName='employees.csv', source='csv'):
+    '''
+    Load the existing daily IN/OT files (or the 'bin' scan log with source='bin') and employees.csv into
+    the database of the 'sqlite' backend, replacing what it held, and merge every month found into
+    the attendance table.
+    The files are left in place.
+    :return: Returns the number of scans and employees imported.
+    :rtype: tuple
+    '''
+    scans = loadscans(EPOCH, dt.date(2149, 6, 1), folder, allscans=True, backend=source)
+    employees = list(employeedirectory(csvName)['byid'].values())
+    with attendancedb(folder) as db:
+        db.execute("DELETE FROM scans")
+        db.executemany("INSERT INTO scans (day, minute, token) VALUES (?, ?, ?)",
+                       zip(scans['Day'].tolist(), scans['Minute'].tolist(), scans['Token ID'].tolist()))
+        db.execute("DELETE FROM employees")
+        db.executemany("INSERT INTO employees VALUES (?, ?, ?, ?, ?)",
+                       [[row[column] for column in EMPLOYEECOLUMNS] for row in employees])
+        db.execute("DELETE FROM attendance")
+    clearreports()
+    m = mergescans(scans)
+    for yearmonth, mg in m.groupby(m['Date'].str[0:7], sort=True):
+        saveattendance(mg, int(yearmonth[:4]), int(yearmonth[5:]))
+    return len(scans), len(employees)
 
 
 # As Part 05 of Project
@@ -236,24 +984,16 @@ def newprofile(ID, csvName, newName1, newMobileNumber, newEMail, tokenID):
     """
     set up new employee file with information given based on function parameters. 
     """
-    csvList = []
-    with open(csvName, 'r') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            csvList.append(row)
-        dfCsv = pd.DataFrame(csvList[1:], columns=csvList[0])
-        newName = newName1
+    newName = newName1
 
     while True:
         if newMobileNumber[0] == '8' or '9':
             if len(newMobileNumber) == 8:
                 if newMobileNumber.isnumeric():
-                    dfCsv.loc[dfCsv['EmployeeID'] == ID, 'MobileNumber'] = newMobileNumber
                     break
 
     while True:  # enter new mobile EMail
         if newEMail.count('@') == 1:
-            dfCsv.loc[dfCsv['EmployeeID'] == ID, 'EMail'] = newEMail
             break
 
     while True:  # enter new tokenID
@@ -261,13 +1001,44 @@ def newprofile(ID, csvName, newName1, newMobileNumber, newEMail, tokenID):
             break
 
     addLine = ID + "," + newName + "," + newMobileNumber + "," + newEMail + "," + str(tokenID)
-    with open(csvName, "a", encoding="utf-8", newline='') as newEmployee:
-        writer = csv.writer(newEmployee)
-        writer.writerow(addLine.split(","))
+    clearreports()
+    if BACKEND == 'sqlite':
+        with attendancedb() as db:
+            db.execute("INSERT OR REPLACE INTO employees VALUES (?, ?, ?, ?, ?)", addLine.split(","))
+        return print(f"Successfully added into {DATABASE}")
+    with filelock(csvName):
+        appendlines(csvName, ','.join(EMPLOYEECOLUMNS) + '\n', [addLine + '\n'])
+        # keep the in-process directory current without reparsing the file
+        addemployee(dict(zip(EMPLOYEECOLUMNS, addLine.split(","))), csvName)
 
     return print("Successfully added into employees.csv")
 
 
+def employeesfile():
+    """
+    Path of employees.csv in the current folder, created with just the header when it does not exist yet.
+    """
+    csvName = os.path.join(os.getcwd(), 'employees.csv')
+    if BACKEND != 'sqlite' and 'employees.csv' not in os.listdir():
+        with filelock(csvName):
+            appendlines(csvName, ','.join(EMPLOYEECOLUMNS) + '\n', [])
+    return csvName
+
+
+def profileerror(ID, newMobileNumber, newEMail, tokenID):
+    """
+    Check profile fields with the rules used by SetTokenProfile, returns the first problem found or None.
+    """
+    if len(ID) != 5 or ID[0] != 'S' or not ID[1:].isnumeric():
+        return "Employee ID must be 'S' followed by 4 digits"
+    if len(newMobileNumber) != 8 or not newMobileNumber.isnumeric() or newMobileNumber[0] not in '89':
+        return "Mobile number must be 8 digits beginning with '8' or '9'"
+    if newEMail.count('@') != 1:
+        return "EMail must have exactly one '@'"
+    if len(str(tokenID)) != 4 or not str(tokenID).isdigit():
+        return "Token ID must be exactly 4 digits"
+    return None
+
 # As Part 05 of Project
 def SetTokenProfile():
     """
@@ -279,27 +1050,27 @@ def SetTokenProfile():
     else:
         pass
 
-    if 'employee.csv' in os.listdir():
-        csvName = os.getcwd() + '\employees.csv'
-    else:
-        columns = ['EmployeeID', 'Name', 'MobileNumber', 'EMail', 'TokenID']
-        employees = pd.DataFrame(columns=columns)
-        employees.to_csv('employees.csv', index_label=False)
-        csvName = os.getcwd() + '\employees.csv'
+    csvName = employeesfile()
 
     while True:  # enter a valid ID
-        ID = input('Please enter your employee ID(S+4-digit):').capitalize()
-        if ID[0] != 'S':
+        ID = input('Please enter your employee ID(S+4-digit) or a csv/jsonl file of profiles:').strip()
+        if os.path.isfile(ID):
+            written, rejected = UpsertProfiles(ID, csvName)
+            print(f"{written} profiles added or updated")
+            if len(rejected) > 0:
+                print(rejected[['EmployeeID', 'TokenID', 'Problem']].to_string(index=False))
+            return
+        ID = ID.capitalize()
+        if ID[:1] != 'S':
             print("Please enter ID begins with 'S'")
         if not ID[1:].isnumeric() or len(ID[1:]) != 4:
             print("Please enter 4-digit after 'S'")
         else:
             break
 
-    dfe = pd.read_csv("employees.csv")
-    ids = dfe[dfe['EmployeeID'] == ID]
-    if len(ids) > 0:
-        print(ids.to_string(index=False))
+    employee = findemployee(ID, csvName)
+    if employee is not None:
+        print(pd.DataFrame([employee]).to_string(index=False))
         updtpro = input("Do you want to update this profile? [Y/N] ").replace(" ", "")
         if updtpro.upper() == 'Y':
             newName = input('Please enter your name:').capitalize()
@@ -315,6 +1086,160 @@ def SetTokenProfile():
         tokenID = inputqrcode()
         newprofile(ID, csvName, newName, newMobileNumber, newEMail, tokenID)
 
+def employeedirectory(csvName='employees.csv'):
+    """
+    In-process employee directory built once from employees.csv and rebuilt when the file's mtime changes.
+    Later rows for the same EmployeeID replace earlier ones, matching drop_duplicates(keep='last').
+    :return: Returns a dict with 'byid' (EmployeeID -> row) and 'bytoken' (TokenID -> row) lookups.
+    :rtype: dict
+    """
+    path = os.path.abspath(csvName)
+    mtime = os.stat(path).st_mtime_ns
+    if DIRECTORY.get('path') != path or DIRECTORY.get('mtime') != mtime:
+        byid = {}
+        with stage('employees.load') as s, open(path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                if row.get('EmployeeID'):
+                    byid.pop(row['EmployeeID'], None)  # re-insert so the latest row decides the order
+                    byid[row['EmployeeID']] = row
+            s.count(files=1, bytes=f.tell(), rows_out=len(byid))
+        DIRECTORY.update(path=path, mtime=mtime, byid=byid,
+                         bytoken={row['TokenID']: row for row in byid.values()}, frame=None)
+    return DIRECTORY
+
+
+def findemployee(ID, csvName='employees.csv'):
+    """
+    Look up an employee by EmployeeID, None when there is no such employee.
+    """
+    if BACKEND == 'sqlite':
+        return sqlemployee("employee_id = ?", ID)
+    return employeedirectory(csvName)['byid'].get(ID)
+
+
+def findtoken(tokenID, csvName='employees.csv'):
+    """
+    Look up the employee currently holding a Token ID, None when the token is not assigned.
+    """
+    if BACKEND == 'sqlite':
+        return sqlemployee("token = ?", int(tokenID))
+    return employeedirectory(csvName)['bytoken'].get(str(tokenID))
+
+
+def sqlemployee(where, value):
+    """
+    One employee of the 'sqlite' backend as an employees.csv row, None when there is no match.
+    """
+    row = attendancedb().execute(f"SELECT employee_id, name, mobile, email, token FROM employees WHERE {where}",
+                                 (value,)).fetchone()
+    return None if row is None else dict(zip(EMPLOYEECOLUMNS, map(str, row)))
+
+
+def addemployee(row, csvName='employees.csv'):
+    """
+    Update the directory in place after a profile row has been appended to employees.csv.
+    """
+    if DIRECTORY.get('path') != os.path.abspath(csvName):
+        employeedirectory(csvName)  # not loaded yet, the file already holds the new row
+        return
+    directory = DIRECTORY
+    previous = directory['byid'].pop(row['EmployeeID'], None)
+    if previous is not None and directory['bytoken'].get(previous['TokenID']) is previous:
+        del directory['bytoken'][previous['TokenID']]
+    directory['byid'][row['EmployeeID']] = row
+    directory['bytoken'][row['TokenID']] = row
+    directory['frame'] = None
+    directory['mtime'] = os.stat(directory['path']).st_mtime_ns
+
+
+def employeeframe(csvName='employees.csv'):
+    """
+    Deduplicated employees as a dataframe, one row per EmployeeID with TokenID as a number.
+    """
+    if BACKEND == 'sqlite':
+        rows = attendancedb().execute("SELECT employee_id, name, mobile, email, token FROM employees").fetchall()
+        return pd.DataFrame(rows, columns=EMPLOYEECOLUMNS)
+    directory = employeedirectory(csvName)
+    if directory['frame'] is None:
+        frame = pd.DataFrame(list(directory['byid'].values()), columns=EMPLOYEECOLUMNS)
+        frame['TokenID'] = pd.to_numeric(frame['TokenID'])
+        directory['frame'] = frame
+    return directory['frame'].copy()
+
+
+def readprofiles(path):
+    """
+    Profile changes from a csv file with the employees.csv header, or from a JSONL file with one object
+    per line using the same keys. Every field is read as text.
+    """
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        changes = pd.read_json(path, lines=True, dtype=False)
+    else:
+        changes = pd.read_csv(path, dtype=str, keep_default_na=False)
+    missing = [column for column in EMPLOYEECOLUMNS if column not in changes.columns]
+    if missing:
+        raise ValueError(f"{path} is missing {', '.join(missing)}")
+    changes = changes[EMPLOYEECOLUMNS].fillna('').astype(str).apply(lambda column: column.str.strip())
+    changes['EmployeeID'] = changes['EmployeeID'].str.capitalize()
+    changes['Name'] = changes['Name'].str.capitalize()
+    return changes
+
+
+def profileproblems(changes):
+    """
+    profileerror for a whole dataframe of profiles at once, None where a row is valid.
+    """
+    problem = pd.Series(None, index=changes.index, dtype=object)
+    checks = [(~changes['TokenID'].str.fullmatch(r'\d{4}'), "Token ID must be exactly 4 digits"),
+              (changes['EMail'].str.count('@') != 1, "EMail must have exactly one '@'"),
+              (~changes['MobileNumber'].str.fullmatch(r'[89]\d{7}'), "Mobile number must be 8 digits beginning with '8' or '9'"),
+              (~changes['EmployeeID'].str.fullmatch(r'S\d{4}'), "Employee ID must be 'S' followed by 4 digits")]
+    for failed, message in checks:  # the last check that fails wins, so the order matches profileerror
+        problem[failed] = message
+    return problem
+
+
+def UpsertProfiles(path, csvName='employees.csv'):
+    """
+    Add or update many employee profiles from a csv or JSONL file in one go.
+    Rows are validated like SetTokenProfile, a later row for the same EmployeeID replaces an earlier one,
+    and rows giving a Token ID already held by another employee (or by another row) are rejected.
+    employees.csv is then rewritten once, compacted to one row per employee.
+    :return: Returns the number of profiles written and the rejected rows with a Problem column.
+    :rtype: tuple
+    """
+    changes = readprofiles(path)
+    changes['Problem'] = profileproblems(changes)
+    with filelock(csvName):
+        if BACKEND == 'sqlite':
+            current = employeeframe().astype(str)
+        else:
+            current = pd.DataFrame(list(employeedirectory(csvName)['byid'].values()), columns=EMPLOYEECOLUMNS)
+        valid = changes[changes['Problem'].isna()].drop_duplicates('EmployeeID', keep='last')
+        others = current[~current['EmployeeID'].isin(valid['EmployeeID'])]
+        # compared as numbers, the way scans are matched, so "0200" and "200" are the same token
+        tokens = pd.to_numeric(valid['TokenID'], errors='coerce')
+        taken = tokens.isin(pd.to_numeric(others['TokenID'], errors='coerce').dropna())
+        repeated = tokens.duplicated(keep=False)
+        changes.loc[valid.index[taken], 'Problem'] = "Token ID already held by another employee"
+        changes.loc[valid.index[repeated & ~taken], 'Problem'] = "Token ID repeated in the file"
+        accepted = valid[~taken & ~repeated][EMPLOYEECOLUMNS]
+
+        clearreports()
+        if BACKEND == 'sqlite':
+            with attendancedb() as db:
+                db.executemany("INSERT OR REPLACE INTO employees VALUES (?, ?, ?, ?, ?)", accepted.values.tolist())
+        else:
+            employees = pd.concat([current[~current['EmployeeID'].isin(accepted['EmployeeID'])], accepted])
+            with atomicpath(csvName) as tmp:
+                employees.to_csv(tmp, encoding='utf-8', index=False)
+            rows = employees.to_dict('records')
+            DIRECTORY.update(path=os.path.abspath(csvName), mtime=os.stat(csvName).st_mtime_ns,
+                             byid={row['EmployeeID']: row for row in rows},
+                             bytoken={row['TokenID']: row for row in rows}, frame=None)
+    return len(accepted), changes[changes['Problem'].notna()]
+
+
 # As Part 08 of Project
 def findfiles(filenamein):
     '''
@@ -336,97 +1261,922 @@ def findfiles(filenamein):
     else:
         return False
 
-# As Part 08 of Project
-def MergeIOFiles():
+def appendbinlog(records, path):
     '''
-    Takes user input of Month/Year and returns a csv file with employee's working time for the month.
+    Append (token, date, time) records to the binary scan log as fixed-width 6 byte entries.
+    :return: Returns the number of records written.
+    :rtype: int
+    '''
+    data = b''.join(SCANRECORD.pack((qrdate - EPOCH).days, qrtime.hour * 60 + qrtime.minute, int(qrcode))
+                    for qrcode, qrdate, qrtime in records)
+    if data:
+        with filelock(path), open(path, 'a+b') as f:
+            # drop a record cut short by a crash so the log stays aligned
+            size = f.seek(0, os.SEEK_END)
+            if size % SCANRECORD.size:
+                f.truncate(size - size % SCANRECORD.size)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    return len(data) // SCANRECORD.size
 
-    All files under the specified directory are read and sorted based on file name pre-fix "In" or "Out".
-    Duplicates in daily record are removed to ensure each employee has only one record of scan in/out on a particular day.
-    Combined and cleaned monthly IN/OUT records (mergein/mergeout) are then merged to form a monthly record of employee's scan-in/out status (merget).
 
-    Records with scan-in time but no scan-out time are assigned scan-out time at 14:00 on the day.
-    Records with scan-out time but no scan-in time are assigned scan-in time at 08:00 on the day.
-    :return: Returns a csv file showing employee's working time on each day for the requested month.
-    :rtype: csv file
+def scandtype():
     '''
-    # Ensure directory is in INOUT Folder
-    if 'INOUT' in os.listdir():
-        os.chdir(os.path.join(os.getcwd(), 'INOUT'))
-    else:
-        pass
+    Numpy record type matching SCANRECORD, built on first use so scanning does not load numpy.
+    '''
+    return np.dtype([('Day', '<u2'), ('Minute', '<u2'), ('Token', '<u2')])
 
-    # Check for month year provided
-    while True:
-        yearmonth = input("Please enter the year-month (YYYY-MM):").replace(" ", "")
-        year = yearmonth[:4]
-        month = yearmonth[5:]
-        vdate = validdate(year, month, str(1))
-        filenamein = f"{str(year)}{str(month).zfill(2)}"
-        ffile = findfiles(filenamein)
-        if vdate==True and ffile==True:
-            break
-        else:
-            print("Date is either not valid or file does not exist")
 
-    datain = []
-    dataot = []
-    for file in os.listdir(os.getcwd()):
-        if f"IN_{filenamein}" in file:
-            fin = pd.read_csv(file)
-            # remove duplicates for multiple scan-in on the day
-            fin.sort_values(["Time"], inplace=True)
-            # to keep first record on the same day
-            fin.drop_duplicates(subset='Token ID', keep='first', inplace=True)
-            datain.append(fin)
-        if f"OT_{filenamein}" in file:
-            fout = pd.read_csv(file)
-            # remove duplicates for multiple scan-out on the day
-            fout.sort_values(["Time"], inplace=True)
-            # to keep last record on the same day
-            fout.drop_duplicates(subset='Token ID', keep='last', inplace=True)
-            dataot.append(fout)
-
-    mergein = pd.concat(datain, ignore_index=True)
-    mergeout = pd.concat(dataot, ignore_index=True)
-    mergein["Token ID"] = mergein["Token ID"].astype("object")
-    merget = pd.merge(mergein, mergeout, on=['Date', 'Token ID'], how='outer', suffixes=('_IN', '_OUT'))
-
-    # for available scan-in but no scan-out cases and vice versa
-    merget['Time_IN'].fillna('12:59', inplace=True)  # Assume earliest time to come into factory
-    merget['Time_OUT'].fillna('14:00', inplace=True)  # Assume earliest time to leave factory
-
-    # formatting datetime
-    merget['Time_INf'] = merget['Date'] + ' ' + merget['Time_IN']
-    merget['Time_INf'] = pd.to_datetime(merget['Time_IN'])
-    merget['Time_OUTf'] = merget['Date'] + ' ' + merget['Time_OUT']
-    merget['Time_OUTf'] = pd.to_datetime(merget['Time_OUT'])
-
-    # filter hours and mins
-    merget["Hour_In"] = merget['Time_INf'].dt.hour
-    merget["Min_In"] = merget['Time_INf'].dt.minute
-    merget["Hour_Out"] = merget['Time_OUTf'].dt.hour
-    merget["Min_Out"] = merget['Time_OUTf'].dt.minute
-
-    # calculate total working hours on the day
-    merget["Hrs"] = np.where(merget["Min_Out"] >= merget['Min_In'], merget["Hour_Out"] - merget["Hour_In"],
-                             (merget["Hour_Out"] - merget["Hour_In"] - 1))
-    merget['Mins'] = np.where(merget["Min_Out"] >= merget['Min_In'], merget["Min_Out"] - merget["Min_In"],
-                              (60 - (merget["Min_In"] - merget["Min_Out"])))
-
-    merget = merget.drop(["Min_Out", "Min_In", "Hour_Out", "Hour_In", "Time_INf", "Time_OUTf"], axis=1)
-
-    # update table formatting
-    merget.columns = ['Date', 'In Time', 'Token ID', 'Out Time', "Hrs", "Mins"]
-    m = merget[['Date', 'In Time', 'Out Time', 'Token ID', "Hrs", "Mins"]]
-    m = m.sort_values(['Date', "In Time", "Out Time"])
-
-    filenameout = f"MG_{str(year)}{str(month).zfill(2)}.csv"
+def readbinlog(path):
+    '''
+    Memory-map the binary scan log, an empty array is returned when there is no log yet.
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) < SCANRECORD.size:
+        return np.zeros(0, dtype=scandtype())
+    # ignore a partially written trailing record
+    count = os.path.getsize(path) // SCANRECORD.size
+    return np.memmap(path, dtype=scandtype(), mode='r', shape=(count,))
 
-    os.chdir('..')  # File ends in Group_Project Folder
-    m.to_csv(filenameout, encoding='utf-8', index=False)  # added index = false
 
-# As Part 09 of Project
+def minutestotime(minutes):
+    '''
+    Format an array of minutes since midnight as HH:MM strings.
+    '''
+    labels = np.array([f"{m // 60:02d}:{m % 60:02d}" for m in range(24 * 60)], dtype=object)
+    return labels[np.asarray(minutes, dtype=np.int64)]
+
+
+def timetominutes(times):
+    '''
+    Convert a series of HH:MM strings to minutes since midnight.
+    '''
+    return (times.str[0:2].astype(np.int64) * 60 + times.str[3:5].astype(np.int64)).to_numpy()
+
+
+def monthrange(start, end):
+    '''
+    Widen start and end to the first and last day of their months.
+    '''
+    first = start.replace(day=1)
+    last = (end.replace(day=1) + dt.timedelta(days=31)).replace(day=1) - dt.timedelta(days=1)
+    return first, last
+
+
+def parsedaily(path, day, isin, allscans=False):
+    '''
+    Parse one daily IN/OT file and keep the first scan-in (IN file) or last scan-out (OT file) per Token ID,
+    or every scan with allscans.
+    Kept at module level so it can run in a worker process.
+    :return: Returns a dataframe with columns Day, Minute, Token ID and IN.
+    :rtype: DataFrame
+    '''
+    scans = pd.read_csv(path, usecols=['Time', 'Token ID'], dtype=str).dropna()
+    scans = pd.DataFrame({'Day': day,
+                          'Minute': timetominutes(scans['Time']),
+                          'Token ID': scans['Token ID'].astype(np.int64), 'IN': isin})
+    scans = scans.sort_values('Minute', kind='stable')
+    if allscans:
+        return scans
+    return scans.drop_duplicates(subset='Token ID', keep='first' if isin else 'last')
+
+
+def dailyfiles(folder, day0, day1, days=None):
+    '''
+    Daily IN/OT files in folder for day numbers day0 to day1 (only those in days when given),
+    in date order with each day's IN file before its OT file.
+    :return: Returns the paths, their day numbers and whether each is an IN file.
+    :rtype: tuple
+    '''
+    files = []
+    with stage('merge.list') as s:
+        for file in os.listdir(folder):
+            if not (file.startswith('IN_') or file.startswith('OT_')) or not file.endswith('.csv'):
+                continue
+            stamp = file[3:11]
+            if not stamp.isdigit() or not validdate(stamp[0:4], stamp[4:6], stamp[6:8]):
+                continue
+            day = (dt.date(int(stamp[0:4]), int(stamp[4:6]), int(stamp[6:8])) - EPOCH).days
+            if day0 <= day <= day1 and (days is None or day in days):
+                files.append((day, not file.startswith('IN_'), os.path.join(folder, file)))
+        s.count(files=len(files))
+    files.sort()
+    return [path for day, ot, path in files], [day for day, ot, path in files], [not ot for day, ot, path in files]
+
+
+def loadscans(start, end, folder='INOUT', days=None, workers=None, allscans=False, backend=None):
+    '''
+    Load every scan between start and end (inclusive) in one go from the configured backend.
+    When days is given only those dates are loaded. Daily files are reduced to first IN / last OUT per
+    token unless allscans is set. backend overrides BACKEND, to read one backend's data while using another.
+    Daily csv files are parsed across workers processes (WORKERS by default) once there are
+    at least PARALLELMIN of them, smaller loads are parsed serially.
+    Times are kept as integer minutes since midnight and days as day numbers, nothing is parsed as datetime.
+    :return: Returns a dataframe with columns Day, Minute, Token ID and IN (True for IN scans).
+    :rtype: DataFrame
+    '''
+    day0, day1 = (start - EPOCH).days, (end - EPOCH).days
+    if days is not None:
+        days = {(d - EPOCH).days for d in days}
+    backend = backend or BACKEND
+    if backend == 'sqlite':
+        return sqlscans(day0, day1, days, allscans, folder)
+    if backend == 'bin':
+        with stage('merge.parse') as s:
+            log = readbinlog(os.path.join(folder, BINLOG))
+            s.count(files=1, bytes=log.nbytes, rows_in=len(log))
+            log = log[(log['Day'] >= day0) & (log['Day'] <= day1)]
+            if days is not None:
+                log = log[np.isin(log['Day'], list(days))]
+            s.count(rows_out=len(log))
+            return pd.DataFrame({'Day': log['Day'].astype(np.int64), 'Minute': log['Minute'].astype(np.int64),
+                                 'Token ID': log['Token'].astype(np.int64), 'IN': log['Minute'] < 13 * 60})
+
+    paths, daynumbers, isin = dailyfiles(folder, day0, day1, days)
+    if not paths:
+        return pd.DataFrame({'Day': [], 'Minute': [], 'Token ID': [], 'IN': []}, dtype=np.int64).astype({'IN': bool})
+
+    if workers is None:
+        workers = WORKERS
+    with stage('merge.parse') as s:
+        if workers > 1 and len(paths) >= PARALLELMIN:
+            import concurrent.futures  # imported here, serial parsing and scanning do not need it
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                chunksize = max(1, len(paths) // (workers * 4))
+                frames = list(pool.map(parsedaily, paths, daynumbers, isin, [allscans] * len(paths),
+                                       chunksize=chunksize))
+        else:
+            frames = [parsedaily(*job, allscans) for job in zip(paths, daynumbers, isin)]
+        scans = pd.concat(frames, ignore_index=True)
+        if METRICS:
+            s.count(files=len(paths), bytes=sum(os.path.getsize(path) for path in paths), rows_out=len(scans))
+    return scans
+
+
+def pairshifts(scans):
+    '''
+    Pair scans into shifts on absolute minutes (day number * 1440 + minute), so a shift may cross midnight.
+    Per token, repeated IN (or OT) scans within BURST minutes are one scan. IN scans (before 1pm) always come
+    before OT scans on a date, so a date with an IN scan is a day shift from its first IN to its last OUT.
+    A date with only OT scans starts a night shift from its first OT scan, ended by the first scan of the
+    next day when that is an IN scan at most SHIFTMAX later; that IN scan then no longer counts for its own
+    date. Days are taken in order, each one vectorized over all tokens.
+    Missing scans get the same defaults as MergeIOFiles, and each token has at most one line per date.
+    :return: Returns Day (of the scan-in), Token ID, In and Out as absolute minutes.
+    :rtype: DataFrame
+    '''
+    token = scans['Token ID'].to_numpy(np.int64)
+    stamp = scans['Day'].to_numpy(np.int64) * 1440 + scans['Minute'].to_numpy(np.int64)
+    isin = scans['IN'].to_numpy(bool)
+    order = np.lexsort((stamp, token))
+    token, stamp, isin = token[order], stamp[order], isin[order]
+
+    # bursts of repeated scans: the first scan is kept for a scan-in, the last for a scan-out
+    starts = np.ones(len(stamp), dtype=bool)
+    starts[1:] = (token[1:] != token[:-1]) | (isin[1:] != isin[:-1]) | (stamp[1:] - stamp[:-1] > BURST)
+    bursts = pd.DataFrame({'Token': token[starts], 'Day': stamp[starts] // 1440, 'IN': isin[starts],
+                           'First': stamp[starts],
+                           'Last': np.maximum.reduceat(stamp, np.flatnonzero(starts)) if len(stamp) else stamp})
+    bursts['Rank'] = bursts.groupby(['Token', 'Day', 'IN']).cumcount()
+
+    # one row per token and date: first and second IN burst, first and last OT scan
+    ins, ots = bursts[bursts['IN']], bursts[~bursts['IN']]
+    days = (bursts[['Day', 'Token']].drop_duplicates().set_index(['Day', 'Token'])
+            .join(ins[ins['Rank'] == 0].set_index(['Day', 'Token'])[['First', 'Last']].add_prefix('In1'))
+            .join(ins[ins['Rank'] == 1].set_index(['Day', 'Token'])['First'].rename('In2'))
+            .join(ins.groupby(['Day', 'Token']).size().rename('Ins'))
+            .join(ots.groupby(['Day', 'Token']).agg(OtFirst=('First', 'min'), OtLast=('Last', 'max')))
+            .sort_index().reset_index())
+    codes = np.unique(days['Token'].to_numpy(), return_inverse=True)[1]
+    ins = days['Ins'].fillna(0).to_numpy(np.int64)
+    in1first, in1last, in2 = (days[c].fillna(-1).to_numpy(np.int64) for c in ('In1First', 'In1Last', 'In2'))
+    otfirst, otlast = (days[c].fillna(-1).to_numpy(np.int64) for c in ('OtFirst', 'OtLast'))
+    hasot = otfirst >= 0
+
+    # night shift waiting for the next day's first scan, per token
+    pending = np.zeros(codes.max() + 1 if len(codes) else 0, dtype=bool)
+    startday, startfirst, startlast = (np.zeros(len(pending), dtype=np.int64) for _ in range(3))
+    lines = []
+    bounds = np.flatnonzero(np.diff(days['Day'].to_numpy(), prepend=-1, append=-1))
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        rows = np.arange(lo, hi)
+        code = codes[rows]
+        day = int(days['Day'].iat[lo])
+        waiting = pending[code]
+        claimed = waiting & (startday[code] == day - 1) & (ins[rows] > 0) & (in1last[rows] - startfirst[code] <= SHIFTMAX)
+        lines.append((startday[code[claimed]], startfirst[code[claimed]], in1last[rows][claimed], code[claimed]))
+        unclaimed = waiting & ~claimed  # the night before found no scan-in, it ends with its own last OUT
+        lines.append((startday[code[unclaimed]], startday[code[unclaimed]] * 1440 + 12 * 60 + 59,
+                      startlast[code[unclaimed]], code[unclaimed]))
+
+        # for available scan-in but no scan-out cases and vice versa
+        firstin = np.where(claimed, in2[rows], in1first[rows])
+        dayshift = firstin >= 0
+        lines.append((np.full(dayshift.sum(), day), firstin[dayshift],
+                      np.where(hasot[rows], otlast[rows], day * 1440 + 14 * 60)[dayshift], code[dayshift]))
+        night = ~dayshift & hasot[rows]
+        pending[code] = night
+        startday[code[night]] = day
+        startfirst[code[night]] = otfirst[rows][night]
+        startlast[code[night]] = otlast[rows][night]
+    left = np.flatnonzero(pending)
+    lines.append((startday[left], startday[left] * 1440 + 12 * 60 + 59, startlast[left], left))
+
+    day, timein, timeout, code = (np.concatenate([np.asarray(line[i], dtype=np.int64) for line in lines])
+                                  if lines else np.zeros(0, dtype=np.int64) for i in range(4))
+    tokens = np.unique(days['Token'].to_numpy(np.int64))
+    return pd.DataFrame({'Day': day, 'Token ID': tokens[code] if len(code) else code, 'In': timein, 'Out': timeout})
+
+
+def mergescans(scans, shifts=None):
+    '''
+    Reduce scans to first scan-in and last scan-out per day and Token ID in a single groupby,
+    using the same defaults for missing scans as MergeIOFiles.
+    With shifts='overnight' (SHIFTS by default) scans are paired across midnight by pairshifts instead,
+    and the line is dated by its scan-in.
+    :return: Returns a dataframe laid out like MG_YYYYMM.csv.
+    :rtype: DataFrame
+    '''
+    if (shifts or SHIFTS) == 'overnight':
+        with stage('merge.reduce') as s:
+            m = pairshifts(scans)
+            timein = m['In'] % 1440
+            timeout = m['Out'] % 1440
+            duration = m['Out'] - m['In']
+            s.count(rows_in=len(scans), rows_out=len(m))
+        return formatmg(m, timein, timeout, duration)
+
+    with stage('merge.reduce') as s:
+        # IN minutes are negated so one max() gives first scan-in and last scan-out together
+        key = np.where(scans['IN'], -scans['Minute'], scans['Minute'])
+        reduced = (pd.DataFrame({'Day': scans['Day'], 'Token ID': scans['Token ID'], 'IN': scans['IN'], 'Key': key})
+                   .groupby(['Day', 'Token ID', 'IN'])['Key'].max().unstack('IN').reindex(columns=[True, False]))
+        m = reduced.reset_index()
+        firstin = -m[True]
+        lastout = m[False]
+
+        # for available scan-in but no scan-out cases and vice versa
+        timein = firstin.fillna(12 * 60 + 59).astype(np.int64)
+        timeout = lastout.fillna(14 * 60).astype(np.int64)
+        duration = timeout - timein
+        s.count(rows_in=len(scans), rows_out=len(m))
+    return formatmg(m, timein, timeout, duration)
+
+
+def formatmg(m, timein, timeout, duration):
+    '''
+    Lay out Day and Token ID of m with scan-in, scan-out and worked minutes like MG_YYYYMM.csv.
+    '''
+    with stage('merge.format') as s:
+        days = {day: (EPOCH + dt.timedelta(days=int(day))).isoformat() for day in m['Day'].unique()}
+        m = pd.DataFrame({'Date': m['Day'].map(days), 'In Time': minutestotime(timein),
+                          'Out Time': minutestotime(timeout), 'Token ID': m['Token ID'].astype(np.int64),
+                          'Hrs': duration // 60, 'Mins': duration % 60})
+        m = m.sort_values(['Date', 'In Time', 'Out Time', 'Token ID']).reset_index(drop=True)
+        s.count(rows_in=len(m), rows_out=len(m))
+    return m
+
+
+def mergerange(start, end, folder='INOUT', workers=None, shifts=None):
+    '''
+    Merged daily attendance between start and end (inclusive), laid out like MG_YYYYMM.csv.
+    Overnight shifts also load the day after end, for the scan-outs of shifts starting on end, and the
+    week before start, so night shifts running into start are recognised as such.
+    '''
+    if (shifts or SHIFTS) != 'overnight':
+        return mergescans(loadscans(start, end, folder, workers=workers))
+    m = mergescans(loadscans(start - dt.timedelta(days=7), end + dt.timedelta(days=1), folder, workers=workers,
+                             allscans=True), 'overnight')
+    return m[(m['Date'] >= start.isoformat()) & (m['Date'] <= end.isoformat())].reset_index(drop=True)
+
+
+def MergeRange(start, end, folder='INOUT', workers=None, shifts=None, budget=None):
+    '''
+    Regenerate MG_YYYYMM.csv for every month from start to end with one load and one reduction.
+    Partial months are widened to whole months so every file written is complete.
+    shifts='overnight' pairs night shift scans across midnight, see pairshifts.
+    With a memory budget (MERGEBUDGET or budget, in MB) day shift merges are streamed by StreamMerge.
+    :return: Returns the names of the files written.
+    :rtype: list
+    '''
+    if (budget or MERGEBUDGET) and (shifts or SHIFTS) != 'overnight':
+        return StreamMerge(start, end, folder, budget)
+    start, end = monthrange(start, end)
+    with filelock(MANIFEST):
+        # signatures are taken before loading, so scans arriving meanwhile are picked up by the next merge
+        signatures = {}
+        month = start
+        while month <= end:
+            signatures[f"{month:%Y-%m}"] = mgsignature(month.year, month.month, folder)
+            month = (month + dt.timedelta(days=31)).replace(day=1)
+
+        m = mergerange(start, end, folder, workers, shifts)
+        manifest = loadmanifest()
+        written = []
+        for yearmonth, mg in m.groupby(m['Date'].astype(str).str[0:7], sort=True):  # months without scans give no rows
+            year, month = int(yearmonth[:4]), int(yearmonth[5:])
+            written.extend(writemg(mg, year, month))
+            manifest[f"MG_{yearmonth.replace('-', '')}.csv"] = signatures[yearmonth]
+        savemanifest(manifest)
+    return written
+
+
+def scanchunks(start, end, folder='INOUT', rows=100000):
+    '''
+    Scans between start and end (inclusive) in chunks of about rows scans from the configured backend,
+    for merges within a memory budget. Each chunk comes with a frontier day number: every scan of the
+    days before it has been given.
+    :return: Yields (dataframe laid out like loadscans, frontier) pairs.
+    :rtype: generator
+    '''
+    day0, day1 = (start - EPOCH).days, (end - EPOCH).days
+    if BACKEND == 'sqlite':
+        cursor = attendancedb(folder).execute("SELECT day, minute, token, minute < 780 FROM scans "
+                                              "WHERE day BETWEEN ? AND ? ORDER BY day", (day0, day1))
+        while True:
+            chunk = cursor.fetchmany(rows)
+            if not chunk:
+                break
+            scans = pd.DataFrame(chunk, columns=['Day', 'Minute', 'Token ID', 'IN'], dtype=np.int64)
+            yield scans.astype({'IN': bool}), chunk[-1][0]
+    elif BACKEND == 'bin':
+        log = readbinlog(os.path.join(folder, BINLOG))
+        # records are in arrival order, so a day is complete once the last record of that day has been read
+        lastseen = np.full(65536, -1, dtype=np.int64)
+        for i in range(0, len(log), rows):
+            days, first = np.unique(log['Day'][i:i + rows][::-1], return_index=True)
+            lastseen[days] = i + min(rows, len(log) - i) - 1 - first
+        pending = np.flatnonzero(lastseen[day0:day1 + 1] >= 0) + day0
+        for i in range(0, len(log), rows):
+            part = log[i:i + rows]
+            part = part[(part['Day'] >= day0) & (part['Day'] <= day1)]
+            pending = pending[lastseen[pending] >= i + rows]
+            yield (pd.DataFrame({'Day': part['Day'].astype(np.int64), 'Minute': part['Minute'].astype(np.int64),
+                                 'Token ID': part['Token'].astype(np.int64), 'IN': part['Minute'] < 13 * 60}),
+                   pending[0] if len(pending) else day1 + 1)
+    else:
+        paths, daynumbers, isin = dailyfiles(folder, day0, day1)
+        chunk = []
+        size = 0
+        for i, path in enumerate(paths):
+            chunk.append(i)
+            size += os.path.getsize(path) // 20  # about 20 bytes per scan line
+            if size >= rows or i == len(paths) - 1:
+                scans = pd.concat([parsedaily(paths[j], daynumbers[j], isin[j]) for j in chunk], ignore_index=True)
+                yield scans, daynumbers[i + 1] if i + 1 < len(paths) else day1 + 1
+                chunk = []
+                size = 0
+    yield pd.DataFrame({'Day': [], 'Minute': [], 'Token ID': [], 'IN': []}, dtype=np.int64).astype({'IN': bool}), day1 + 1
+
+
+def reducescans(scans):
+    '''
+    Keep only the first IN and last OUT scan per day and Token ID; merging the result gives the same
+    attendance as merging all of scans.
+    '''
+    key = np.where(scans['IN'], -scans['Minute'], scans['Minute'])
+    reduced = (pd.DataFrame({'Day': scans['Day'], 'Token ID': scans['Token ID'], 'IN': scans['IN'], 'Key': key})
+               .groupby(['Day', 'Token ID', 'IN'], sort=False)['Key'].max().reset_index())
+    return pd.DataFrame({'Day': reduced['Day'], 'Minute': reduced['Key'].abs(),
+                         'Token ID': reduced['Token ID'], 'IN': reduced['IN']})
+
+
+def StreamMerge(start, end, folder='INOUT', budget=None):
+    '''
+    MergeRange within a memory budget in MB (MERGEBUDGET by default): scans are read in date order
+    in chunks sized to the budget, only the first IN / last OUT of days not yet complete is carried
+    from one chunk to the next, and each completed day is appended to its month's MG files.
+    Gives the same MG files as MergeRange. Scans are paired within a date.
+    :return: Returns the names of the files written.
+    :rtype: list
+    '''
+    rows = max(1000, (budget or MERGEBUDGET) * 1024 * 1024 // SCANROWBYTES)
+    start, end = monthrange(start, end)
+    with filelock(MANIFEST), contextlib.ExitStack() as stack:
+        signatures = {}
+        month = start
+        while month <= end:
+            signatures[f"{month:%Y-%m}"] = mgsignature(month.year, month.month, folder)
+            month = (month + dt.timedelta(days=31)).replace(day=1)
+
+        manifest = loadmanifest()
+        written = []
+        current, monthstack = None, None  # month being written and its open MG files
+        carried = reducescans(pd.DataFrame({'Day': [], 'Minute': [], 'Token ID': [], 'IN': []}, dtype=np.int64)
+                              .astype({'IN': bool}))
+        for scans, frontier in scanchunks(start, end, folder, rows):
+            with stage('merge.stream') as s:
+                carried = reducescans(pd.concat([carried, scans], ignore_index=True))
+                done = carried['Day'] < frontier
+                s.count(rows_in=len(scans), rows_out=int(done.sum()))
+            if not done.any():
+                continue
+            m = mergescans(carried[done], 'day')
+            carried = carried[~done]
+            for yearmonth, mg in m.groupby(m['Date'].str[0:7], sort=True):
+                if yearmonth != current:
+                    if monthstack is not None:
+                        monthstack.close()  # days come in order, so the previous month is complete
+                        manifest[f"MG_{current.replace('-', '')}.csv"] = signatures[current]
+                    # an error before the month is closed unwinds it without replacing the old files
+                    monthstack = stack.enter_context(contextlib.ExitStack())
+                    write = monthstack.enter_context(mgwriter(int(yearmonth[:4]), int(yearmonth[5:]), written))
+                    current = yearmonth
+                with stage('merge.write') as s:
+                    write(mg)
+                    s.count(rows_in=len(mg))
+        if monthstack is not None:
+            monthstack.close()
+            manifest[f"MG_{current.replace('-', '')}.csv"] = signatures[current]
+        savemanifest(manifest)
+    return written
+
+
+def writemg(mg, year, month):
+    '''
+    Save a month of merged attendance as MG_YYYYMM.csv and/or MG_YYYYMM.parquet depending on MGFORMAT.
+    The parquet file is typed: Date as date32, times as int16 minutes since midnight, Token ID, Hrs and Mins as int16.
+    :return: Returns the names of the files written.
+    :rtype: list
+    '''
+    with stage('merge.write') as s:
+        written = savemg(mg, year, month)
+        s.count(rows_in=len(mg), files=len(written))
+    return written
+
+
+def savemg(mg, year, month):
+    '''
+    Write the MG files of a month, see writemg.
+    '''
+    written = []
+    with mgwriter(year, month, written) as write:
+        write(mg)
+    return written
+
+
+def mgtable(mg):
+    '''
+    Merged attendance as a typed arrow table for MG_YYYYMM.parquet, see writemg.
+    '''
+    return pa.table({
+        'Date': pa.array(pd.to_datetime(mg['Date'], format='%Y-%m-%d').dt.date, pa.date32()),
+        'In Time': pa.array(timetominutes(mg['In Time']), pa.int16()),
+        'Out Time': pa.array(timetominutes(mg['Out Time']), pa.int16()),
+        'Token ID': pa.array(mg['Token ID'].to_numpy(), pa.int16()),
+        'Hrs': pa.array(mg['Hrs'].to_numpy(), pa.int16()),
+        'Mins': pa.array(mg['Mins'].to_numpy(), pa.int16())})
+
+
+@contextlib.contextmanager
+def mgwriter(year, month, written):
+    '''
+    Write the MG files of a month a part at a time: gives a function taking the month's rows in order,
+    in as many calls as needed, and swaps the finished files in when the block ends.
+    The names written are added to written.
+    '''
+    clearreports()
+    filenameout = f"MG_{year}{str(month).zfill(2)}"
+    with contextlib.ExitStack() as stack:
+        writers = []
+        if BACKEND == 'sqlite':
+            first, last = monthrange(dt.date(year, month, 1), dt.date(year, month, 1))
+            db = attendancedb()
+            stack.enter_context(db)  # one transaction for the month
+            db.execute("DELETE FROM attendance WHERE day BETWEEN ? AND ?", ((first - EPOCH).days, (last - EPOCH).days))
+            writers.append(lambda mg: db.executemany("INSERT INTO attendance VALUES (?, ?, ?, ?, ?)", attendancerows(mg)))
+            names = [f"{filenameout} in {DATABASE}"]
+        else:
+            names = []
+            if MGFORMAT in ('parquet', 'both') and HASPARQUET:
+                tmp = stack.enter_context(atomicpath(filenameout + '.parquet'))
+                schema = pa.schema([('Date', pa.date32())] + [(column, pa.int16()) for column in
+                                                               ['In Time', 'Out Time', 'Token ID', 'Hrs', 'Mins']])
+                table = stack.enter_context(pq.ParquetWriter(tmp, schema))
+                writers.append(lambda mg: table.write_table(mgtable(mg)))
+                names.append(filenameout + '.parquet')
+            elif MGFORMAT == 'parquet':
+                print("pyarrow is not installed, writing csv instead")
+            if MGFORMAT != 'parquet' or not HASPARQUET:
+                tmp = stack.enter_context(atomicpath(filenameout + '.csv'))
+                f = stack.enter_context(open(tmp, 'w', encoding='utf-8', newline=''))
+                writers.append(lambda mg: mg.to_csv(f, index=False, header=f.tell() == 0))
+                names.append(filenameout + '.csv')
+
+        def write(mg):
+            for writer in writers:
+                writer(mg)
+        yield write
+    if filenameout + '.parquet' not in names and os.path.exists(filenameout + '.parquet'):
+        os.remove(filenameout + '.parquet')  # readmg prefers parquet, so an older one would shadow the new csv
+    written.extend(names)
+
+
+def readmg(year, month, start=None, end=None):
+    '''
+    Read a month of merged attendance laid out like MG_YYYYMM.csv, optionally limited to start..end.
+    MG_YYYYMM.parquet is preferred when present, with the date range pushed down into the parquet reader.
+    :return: Returns the dataframe, None when the month has not been merged.
+    :rtype: DataFrame
+    '''
+    if BACKEND == 'sqlite':
+        if not mgexists(year, month):
+            return None
+        first, last = monthrange(dt.date(year, month, 1), dt.date(year, month, 1))
+        return readattendance(start or first, end or last)
+    filenamein = f"MG_{year}{str(month).zfill(2)}"
+    if HASPARQUET and os.path.exists(filenamein + '.parquet'):
+        filters = None
+        if start is not None:
+            filters = [('Date', '>=', start), ('Date', '<=', end)]
+        mg = pq.read_table(filenamein + '.parquet', filters=filters).to_pandas()
+        days = {day: str(day)[:10] for day in mg['Date'].unique()}
+        mg['Date'] = mg['Date'].map(days)
+        mg['In Time'] = minutestotime(mg['In Time'])
+        mg['Out Time'] = minutestotime(mg['Out Time'])
+        return mg.astype({'Token ID': np.int64, 'Hrs': np.int64, 'Mins': np.int64})
+    if os.path.exists(filenamein + '.csv'):
+        mg = pd.read_csv(filenamein + '.csv', dtype={'Date': str, 'In Time': str, 'Out Time': str})
+        if start is not None:
+            mg = mg[(mg['Date'] >= str(start)) & (mg['Date'] <= str(end))]
+        return mg
+    return None
+
+
+def mgexists(year, month):
+    '''
+    Check whether a month has been merged, in either MG format or into the attendance table.
+    '''
+    if BACKEND == 'sqlite':
+        first, last = monthrange(dt.date(year, month, 1), dt.date(year, month, 1))
+        return attendancedb().execute("SELECT 1 FROM attendance WHERE day BETWEEN ? AND ? LIMIT 1",
+                                      ((first - EPOCH).days, (last - EPOCH).days)).fetchone() is not None
+    filenamein = f"MG_{year}{str(month).zfill(2)}"
+    return os.path.exists(filenamein + '.csv') or (HASPARQUET and os.path.exists(filenamein + '.parquet'))
+
+
+def loadmanifest():
+    '''
+    Read the MG manifest, an empty manifest is returned when there is none yet.
+    '''
+    if not os.path.exists(MANIFEST):
+        return {}
+    with open(MANIFEST, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def savemanifest(manifest):
+    '''
+    Write the MG manifest.
+    '''
+    with atomicpath(MANIFEST) as tmp:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def mgsignature(year, month, folder='INOUT'):
+    '''
+    Signature of the scan data behind MG_YYYYMM.csv: mtime and size of each daily IN/OT file,
+    the size of the append-only scan log for the 'bin' backend, or the last scan row for 'sqlite'.
+    '''
+    if BACKEND == 'sqlite':
+        return {'scans': attendancedb(folder).execute("SELECT coalesce(max(rowid), 0) FROM scans").fetchone()[0]}
+    if BACKEND == 'bin':
+        path = os.path.join(folder, BINLOG)
+        return {BINLOG: os.path.getsize(path) if os.path.exists(path) else 0}
+
+    signature = {}
+    filenamein = f"{year}{str(month).zfill(2)}"
+    for file in os.listdir(folder):
+        if file.startswith(f"IN_{filenamein}") or file.startswith(f"OT_{filenamein}"):
+            stat = os.stat(os.path.join(folder, file))
+            signature[file] = [stat.st_mtime_ns, stat.st_size]
+    return signature
+
+
+def changeddays(old, new, folder='INOUT'):
+    '''
+    Dates whose scans differ between two signatures from mgsignature.
+    '''
+    if BACKEND == 'sqlite':
+        if 'scans' not in old or new['scans'] < old['scans']:
+            return None  # scans were reimported, nothing can be spliced
+        added = attendancedb(folder).execute("SELECT DISTINCT day FROM scans WHERE rowid > ?", (old['scans'],)).fetchall()
+        return {EPOCH + dt.timedelta(days=day) for day, in added}
+    if BACKEND == 'bin':
+        if BINLOG not in old or new[BINLOG] < old[BINLOG]:
+            return None  # log was rewritten, nothing can be spliced
+        log = readbinlog(os.path.join(folder, BINLOG))
+        added = log[old[BINLOG] // SCANRECORD.size:]
+        return {EPOCH + dt.timedelta(days=int(day)) for day in np.unique(added['Day'])}
+
+    files = {f for f in set(old) | set(new) if old.get(f) != new.get(f)}
+    return {dt.date(int(f[3:7]), int(f[7:9]), int(f[9:11])) for f in files}
+
+
+def MergeIncremental(year, month, folder='INOUT'):
+    '''
+    Bring MG_YYYYMM.csv up to date by recomputing only the days whose IN/OT files (or scan log records)
+    changed since the last merge, as recorded in the MG manifest, and splicing them into the existing file.
+    Falls back to a full MergeRange of the month when there is no usable previous merge.
+    :return: Returns the dates that were recomputed, None when the whole month was rebuilt.
+    :rtype: set
+    '''
+    with filelock(MANIFEST):
+        return mergeincremental(year, month, folder)
+
+
+def mergeincremental(year, month, folder):
+    '''
+    MergeIncremental without taking the MG lock.
+    '''
+    filenameout = f"MG_{year}{str(month).zfill(2)}.csv"
+    manifest = loadmanifest()
+    signature = mgsignature(year, month, folder)
+    first, last = monthrange(dt.date(year, month, 1), dt.date(year, month, 1))
+
+    days = None
+    # a changed day can move scans between neighbouring days' shifts, so overnight merges redo the month
+    if filenameout in manifest and mgexists(year, month) and SHIFTS != 'overnight':
+        days = changeddays(manifest[filenameout], signature, folder)
+    if days is None:
+        MergeRange(first, last, folder)
+        return None
+    days = {d for d in days if first <= d <= last}
+    if not days:
+        return days
+
+    fresh = mergescans(loadscans(first, last, folder, days))
+    mg = readmg(year, month)
+    mg = mg[~mg['Date'].isin([d.isoformat() for d in days])]
+    mg = pd.concat([mg, fresh], ignore_index=True)
+    mg = mg.sort_values(['Date', 'In Time', 'Out Time', 'Token ID'])
+    writemg(mg, year, month)
+
+    manifest[filenameout] = signature
+    savemanifest(manifest)
+    return days
+
+
+def ConvertToBinlog(folder='INOUT', path=None, merge=False):
+    '''
+    Migrate the existing IN_YYYYMMDD/OT_YYYYMMDD csv files in folder into a binary scan log, written
+    in date and time order; the csv files are left in place.
+    A log already holding scans is kept with merge=True, and the csv scans it does not hold yet are
+    appended to it; otherwise FileExistsError is raised.
+    :return: Returns the number of records written.
+    :rtype: int
+    '''
+    if path is None:
+        path = os.path.join(folder, BINLOG)
+
+    frames = []
+    for file in sorted(os.listdir(folder)):
+        if file.endswith('.csv') and (file.startswith('IN_') or file.startswith('OT_')):
+            frames.append(pd.read_csv(os.path.join(folder, file), dtype=str))
+    if not frames:
+        return 0
+
+    scans = pd.concat(frames, ignore_index=True).dropna()
+    dates = pd.to_datetime(scans['Date'], format='%Y-%m-%d')
+    records = np.zeros(len(scans), dtype=scandtype())
+    records['Day'] = (dates - pd.Timestamp(EPOCH)).dt.days
+    records['Minute'] = timetominutes(scans['Time'])
+    records['Token'] = scans['Token ID'].astype(int)
+
+    records.sort(order=['Day', 'Minute'], kind='stable')
+    with filelock(path):
+        existing = readbinlog(path)
+        if not len(existing):
+            with atomicpath(path) as tmp:
+                with open(tmp, 'wb') as f:
+                    f.write(records.tobytes())
+            return len(records)
+        if not merge:
+            raise FileExistsError(f"{path} already holds {len(existing)} scans")
+
+        # only scans the log is missing are appended, the log stays in arrival order for MergeIncremental
+        held = pd.DataFrame(np.array(existing)).value_counts().rename('Held').reset_index()
+        del existing
+        frame = pd.DataFrame(records)
+        frame['Occurrence'] = frame.groupby(list(records.dtype.names), sort=False).cumcount()
+        frame = frame.merge(held, on=list(records.dtype.names), how='left')
+        added = records[(frame['Occurrence'] >= frame['Held'].fillna(0)).to_numpy()]
+        with open(path, 'a+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size % SCANRECORD.size:
+                f.truncate(size - size % SCANRECORD.size)
+            f.write(added.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    return len(added)
+
+# As Part 08 of Project
+def MergeIOFiles():
+    '''
+    Takes user input of Month/Year and returns a csv file with employee's working time for the month.
+
+    All scans of the month are loaded in one go and reduced to each employee's first scan-in and last scan-out on a particular day.
+    The monthly record of employee's scan-in/out status is kept up to date through MergeIncremental,
+    which only recomputes the days whose files changed since the last merge.
+
+    Records with scan-in time but no scan-out time are assigned scan-out time at 14:00 on the day.
+    Records with scan-out time but no scan-in time are assigned scan-in time at 12:59 on the day.
+    :return: Returns a csv file showing employee's working time on each day for the requested month.
+    :rtype: csv file
+    '''
+    # Ensure directory is in INOUT Folder
+    if 'INOUT' in os.listdir():
+        os.chdir(os.path.join(os.getcwd(), 'INOUT'))
+    else:
+        pass
+
+    # Check for month year provided
+    while True:
+        yearmonth = input("Please enter the year-month (YYYY-MM):").replace(" ", "")
+        year = yearmonth[:4]
+        month = yearmonth[5:]
+        vdate = validdate(year, month, str(1))
+        filenamein = f"{str(year)}{str(month).zfill(2)}"
+        if BACKEND in ('bin', 'sqlite') and vdate == True:
+            # month exists when the scan log or database holds any record for it
+            first, last = monthrange(dt.date(int(year), int(month), 1), dt.date(int(year), int(month), 1))
+            ffile = len(loadscans(first, last, '.')) > 0
+        else:
+            ffile = findfiles(filenamein)
+        if vdate==True and ffile==True:
+            break
+        else:
+            print("Date is either not valid or file does not exist")
+
+    os.chdir('..')  # File ends in Group_Project Folder
+    # only days whose scans changed since the last merge are recomputed
+    MergeIncremental(int(year), int(month))
+
+def reportinputs(start, end):
+    '''
+    Fingerprints (path, mtime, size) of every file a report from start to end reads.
+    '''
+    paths = ['employees.csv']
+    if BACKEND == 'sqlite':
+        paths = [DATABASE, DATABASE + '-wal']
+    elif BACKEND == 'bin':
+        paths.append(os.path.join('INOUT', BINLOG))
+    else:
+        month = start.replace(day=1)
+        while month <= end:
+            paths += [f"MG_{month:%Y%m}.csv", f"MG_{month:%Y%m}.parquet"]
+            month = (month + dt.timedelta(days=31)).replace(day=1)
+    if start == end:
+        paths.append(os.path.join('INOUT', SCANINDEX))
+    inputs = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            inputs.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(inputs)
+
+
+def cachedreport(kind, start, end, compute):
+    '''
+    Report result of kind from start to end, from the report cache when its inputs are unchanged,
+    otherwise from compute() which is then cached. Keys hold the fingerprints of the inputs, so merges and
+    profile changes in any process invalidate older results. The CACHESIZE most recently used reports are
+    kept in memory and, when CACHEDIR is set, on disk as well.
+    :return: Returns a copy of the cached dataframe.
+    :rtype: DataFrame
+    '''
+    if CACHESIZE <= 0:
+        return compute()
+    key = (kind, str(start), str(end), BACKEND, SHIFTS, os.getcwd(), reportinputs(start, end))
+    with stage('report.cache') as s:
+        if key in REPORTS:
+            REPORTS.move_to_end(key)
+            s.count(rows_out=len(REPORTS[key]))
+            return REPORTS[key].copy()
+        path = None
+        if CACHEDIR:
+            path = os.path.join(CACHEDIR, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.pkl')
+            if os.path.exists(path):
+                os.utime(path)  # most recently used
+                REPORTS[key] = pd.read_pickle(path)
+                s.count(files=1, rows_out=len(REPORTS[key]))
+                trimreports()
+                return REPORTS[key].copy()
+
+    result = compute()
+    REPORTS[key] = result.copy()
+    if path is not None:
+        os.makedirs(CACHEDIR, exist_ok=True)
+        with atomicpath(path) as tmp:
+            result.to_pickle(tmp)
+    trimreports()
+    return result
+
+
+def trimreports():
+    '''
+    Evict the least recently used reports beyond CACHESIZE, in memory and in CACHEDIR.
+    '''
+    while len(REPORTS) > CACHESIZE:
+        REPORTS.popitem(last=False)
+    if CACHEDIR and os.path.isdir(CACHEDIR):
+        files = [os.path.join(CACHEDIR, f) for f in os.listdir(CACHEDIR) if f.endswith('.pkl')]
+        files.sort(key=os.path.getmtime)
+        for path in files[:max(0, len(files) - CACHESIZE)]:
+            os.remove(path)
+
+
+def clearreports():
+    '''
+    Drop the in-memory report cache after this process changed merged attendance or employees.
+    Cached files on disk are keyed by input fingerprints and simply stop matching.
+    '''
+    REPORTS.clear()
+
+
+def loadmg(start, end, useindex=True):
+    '''
+    Merged attendance between start and end (inclusive), reading each MG file of the range once.
+    Months without an MG file are reported and skipped.
+    A single day is answered from the scan index when it has been built, which also includes
+    scans made since the last merge; range reports reading a day at a time pass useindex=False.
+    '''
+    if useindex and start == end and SHIFTS != 'overnight' and os.path.exists(os.path.join('INOUT', SCANINDEX)):
+        return indexday(start)
+    if BACKEND == 'bin':
+        return mergerange(start, end)
+    if BACKEND == 'sqlite':
+        with stage('report.load') as s:
+            dfmg = readattendance(start, end)
+            s.count(rows_out=len(dfmg))
+        return dfmg
+
+    frames = []
+    month = start.replace(day=1)
+    with stage('report.load') as s:
+        while month <= end:
+            dfmg = readmg(month.year, month.month, start, end)
+            if dfmg is not None:
+                frames.append(dfmg)
+                if METRICS:
+                    mgfiles = [f"MG_{month:%Y%m}.{ext}" for ext in ('parquet', 'csv')]
+                    s.count(files=1, bytes=next(os.path.getsize(f) for f in mgfiles if os.path.exists(f)))
+            else:
+                print(f"MG_{month.strftime('%Y%m')} does not exist, please merge {month.strftime('%Y-%m')} first")
+            month = (month + dt.timedelta(days=31)).replace(day=1)
+        if not frames:
+            return pd.DataFrame(columns=['Date', 'In Time', 'Out Time', 'Token ID', 'Hrs', 'Mins'])
+        dfmg = pd.concat(frames, ignore_index=True)
+        s.count(rows_out=len(dfmg))
+    return dfmg
+
+
+def overtime(dfmg):
+    '''
+    Employees clocking overtime on each day of the merged attendance dfmg.
+    :return: Returns a dataframe with Date, EmployeeID, Name, Work and Overtime in mins.
+    :rtype: DataFrame
+    '''
+    with stage('report.overtime') as s:
+        dfe = employeeframe()
+        dfm = pd.merge(dfmg, dfe, left_on='Token ID', right_on='TokenID')
+
+        # finding the total duration worked in minutes
+        duration = (dfm['Hrs'] * 60) + dfm['Mins']
+
+        # duration only qualifies if he stays at least 9 hours and 15 mins at work
+        dfm = dfm[duration >= ((9 * 60) + 15)].copy()
+        dfm['Overtime in mins'] = duration[duration >= ((9 * 60) + 15)] - (9 * 60)  # overtime is the excess time after 9 hours
+
+        # creation of 'Work' column
+        dfm['Work'] = dfm['Hrs'].astype(str) + " Hours " + dfm['Mins'].astype(str) + " Mins "
+        s.count(rows_in=len(dfmg), rows_out=len(dfm))
+    return dfm[['Date', 'EmployeeID', 'Name', 'Work', 'Overtime in mins']]
+
+
+def OverTimeRange(start, end):
+    '''
+    Overtime report for every day from start to end (inclusive) from one attendance matrix.
+    Per-day rows are followed by one 'Total' row per employee with total overtime minutes and days with overtime.
+    :return: Returns a csv file Overtime_report_<start>_<end>.csv
+    :rtype: csv file
+    '''
+    daily = cachedreport('overtime', start, end, lambda: overtimematrix(attendancematrix(start, end)))
+    totals = (daily.groupby(['EmployeeID', 'Name'], as_index=False)
+              .agg(**{'Overtime in mins': ('Overtime in mins', 'sum'), 'Days with OT': ('Date', 'nunique')}))
+    totals.insert(0, 'Date', 'Total')
+
+    dfreport = pd.concat([daily, totals], ignore_index=True)
+    dfreport['Days with OT'] = dfreport['Days with OT'].astype('Int64')
+    dfreport = dfreport[['Date', 'EmployeeID', 'Name', 'Work', 'Overtime in mins', 'Days with OT']]
+    filename = f"Overtime_report_{start}_{end}.csv"
+    with atomicpath(filename) as tmp:
+        dfreport.to_csv(tmp, encoding='utf-8', index=False)
+    print(f"{len(daily)} overtime records for {len(totals)} employees from {start} to {end} saved to {filename}")
+    return dfreport
+
+# As Part 09 of Project
 def OverTimeReport():
     '''
     This is an overtime report, displays employee overtime hours by day and saves into CSV
@@ -442,48 +2192,20 @@ def OverTimeReport():
         year, month, day = inputdate()
         pdate = dt.date(year, month, day)
     
-        # finding the corresponding MG_YYYYMM.csv
-        fileopen = str("MG_") + str(year) + str(month).zfill(2)
-        if not ".csv" in fileopen:
-            fileopen += ".csv"
-        
-        files = []
-        for file in os.listdir(os.getcwd()):
-            files.append(file)
-
-        found = []
-        for f in files:
-            if fileopen in f:
-                found.append(1)
-            else:
-                found.append(0)
-    
-        if any(found) == True:
+        # finding the corresponding MG_YYYYMM file
+        if mgexists(year, month) or BACKEND == 'bin':
             break
         else:
             print("Date is either not valid or file does not exist")
 
-    dfmg = pd.read_csv(fileopen)
-    dfmg = dfmg.loc[dfmg['Date'] == str(pdate)]
-
-    # reading the employees.csv file to merge both files together
-    dfe = pd.read_csv("employees.csv")
-    dfe['TokenID'] = dfe['TokenID'].astype('object')
-    dfe.drop_duplicates(keep='last', subset='EmployeeID', inplace=True)
-    dfm = pd.merge(dfmg, dfe, left_on='Token ID', right_on='TokenID')
+    overtimereport(pdate)
 
-    # filtering out the date as per userinput
-    dfmdate = dfm[dfm['Date'] == str(pdate)]
 
-    # finding the total duration worked in minutes
-    dfmdate['Duration'] = (dfmdate['Hrs'] * 60) + dfmdate['Mins']
-
-    # finding the overtime duration
-    dfmdate = dfmdate[dfmdate['Duration'] >= ((9 * 60) + 15)]  # we add 15 because duration only qualifies if he stays at least 9 hours and 15 mins at work.
-    dfmdate['Overtime in mins'] = dfmdate['Duration'] - (9 * 60)  # computation overtime is the excess time after 9 hours
-
-    # creation of 'Work' column
-    dfmdate['Work'] = dfmdate['Hrs'].astype(str) + " Hours " + dfmdate['Mins'].astype(str) + " Mins "
+def overtimereport(pdate):
+    '''
+    Display and save the overtime report of a single day.
+    '''
+    dfmdate = cachedreport('overtime', pdate, pdate, lambda: overtime(loadmg(pdate, pdate)))
 
     # generation of overtime report
     print("Over Time List For {}".format(pdate))
@@ -494,7 +2216,129 @@ def OverTimeReport():
         print(dfreport.reset_index(drop=True))
     else:
         print('There are no employees clocking overtime today')
-    dfreport.to_csv(filename, encoding='utf-8', index=False)
+    with atomicpath(filename) as tmp:
+        dfreport.to_csv(tmp, encoding='utf-8', index=False)
+
+def attendancematrix(start, end):
+    """
+    Merged attendance from start to end (inclusive) as compact employees x days arrays, loaded a month
+    at a time: int16 'in', 'out' and 'worked' minutes, and boolean 'present', 'noin' and 'noout' masks
+    (the last two mark scan-ins and scan-outs filled in with the 12:59 / 14:00 defaults), plus a boolean
+    'merged' per day telling which days belong to a merged month, as nobody can be absent on the others.
+    A year for 10000 employees takes about 30 MB. Scans from unassigned tokens are ignored, and when a day
+    has more than one line for a token (overnight shifts) the worked minutes are added up.
+    :return: Returns a dict with 'employees' (row order of the arrays), 'days' and the arrays.
+    :rtype: dict
+    """
+    df_ee = employeeframe()
+    days = [start + dt.timedelta(days=i) for i in range((end - start).days + 1)]
+    shape = (len(df_ee), len(days))
+    matrix = {'employees': df_ee, 'days': days,
+              'in': np.zeros(shape, dtype=np.int16), 'out': np.zeros(shape, dtype=np.int16),
+              'worked': np.zeros(shape, dtype=np.int16), 'present': np.zeros(shape, dtype=bool),
+              'merged': np.zeros(len(days), dtype=bool)}
+
+    # a Token ID shared by several employees marks each of their rows, as merging on Token ID would
+    tokens = pd.DataFrame({'Token ID': df_ee['TokenID'].to_numpy(np.int64), 'Row': np.arange(len(df_ee))})
+    column = {str(day): i for i, day in enumerate(days)}
+    month = start.replace(day=1)
+    while month <= end:
+        last = min(end, monthrange(month, month)[1])
+        dfmg = loadmg(max(start, month), last, useindex=False)  # the whole range from the MG files alike
+        # the 'bin' backend merges straight from the scan log, so every month counts as merged
+        merged = BACKEND == 'bin' or mgexists(month.year, month.month)
+        matrix['merged'][(max(start, month) - start).days:(last - start).days + 1] = merged
+        with stage('report.matrix') as s:
+            columns = dfmg['Date'].map(column).to_numpy()
+            hits = pd.DataFrame({'Token ID': dfmg['Token ID'].to_numpy(np.int64), 'Line': np.arange(len(dfmg))})
+            hits = hits[~np.isnan(columns)].merge(tokens, on='Token ID')
+            lines = hits['Line'].to_numpy()
+            rows = hits['Row'].to_numpy()
+            columns = columns[lines].astype(np.int64)
+            matrix['in'][rows, columns] = timetominutes(dfmg['In Time'].iloc[lines])
+            matrix['out'][rows, columns] = timetominutes(dfmg['Out Time'].iloc[lines])
+            matrix['present'][rows, columns] = True
+            worked = (dfmg['Hrs'] * 60 + dfmg['Mins']).to_numpy(np.int16)
+            np.add.at(matrix['worked'], (rows, columns), worked[lines])
+            s.count(rows_in=len(dfmg), rows_out=len(lines))
+        month = (month + dt.timedelta(days=31)).replace(day=1)
+    matrix['noin'] = matrix['present'] & (matrix['in'] == 12 * 60 + 59)
+    matrix['noout'] = matrix['present'] & (matrix['out'] == 14 * 60)
+    return matrix
+
+
+def presencematrix(start, end):
+    """
+    Boolean employees x days matrix of who scanned on each day from start to end (inclusive).
+    Memory grows with employees times days rather than with merged rows.
+    :return: Returns the employees dataframe (row order of the matrix), the list of days, the matrix
+             and which days belong to a merged month.
+    :rtype: tuple
+    """
+    matrix = attendancematrix(start, end)
+    return matrix['employees'], matrix['days'], matrix['present'], matrix['merged']
+
+
+def absentees(day):
+    """
+    Employees absent on a day: everyone in the directory minus the tokens present that day.
+    """
+    if BACKEND == 'sqlite':
+        with stage('report.absent') as s:
+            rows = attendancedb().execute("""SELECT employee_id, name, mobile, email, token FROM employees e
+                                             WHERE NOT EXISTS (SELECT 1 FROM attendance a WHERE a.day = ? AND a.token = e.token)""",
+                                          ((day - EPOCH).days,)).fetchall()
+            s.count(rows_out=len(rows))
+        return pd.DataFrame(rows, columns=EMPLOYEECOLUMNS)
+    dfmg = loadmg(day, day)
+    with stage('report.absent') as s:
+        present = set(dfmg['Token ID'])
+        df_ee = employeeframe()
+        absent = df_ee[~df_ee['TokenID'].isin(present)]
+        s.count(rows_in=len(dfmg), rows_out=len(absent))
+    return absent
+
+
+def longeststreak(absent):
+    """
+    Longest run of consecutive True values in each row of a boolean matrix.
+    """
+    padded = np.zeros((absent.shape[0], absent.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = absent
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]  # runs come out row by row, so ends line up with starts
+    streak = np.zeros(absent.shape[0], dtype=np.int64)
+    np.maximum.at(streak, rows, ends - starts)
+    return streak
+
+
+def absentsummary(start, end):
+    """
+    Days absent and longest absence streak of each employee absent at least once from start to end.
+    Days of months not merged yet are not counted.
+    """
+    df_ee, days, present, merged = presencematrix(start, end)
+    absent = ~present & merged
+    a_report = df_ee[['EmployeeID', 'Name']].copy()
+    a_report['Days absent'] = absent.sum(axis=1)
+    a_report['Longest streak'] = longeststreak(absent)
+    return a_report[a_report['Days absent'] > 0]
+
+
+def AbsentRange(start, end):
+    """
+    Absentee summary from start to end (inclusive): days absent and longest absence streak per employee.
+    :return: Returns a csv file Absent_report_<start>_<end>.csv
+    :rtype: csv file
+    """
+    a_report = cachedreport('absentrange', start, end, lambda: absentsummary(start, end))
+
+    filename = f"Absent_report_{start}_{end}.csv"
+    with atomicpath(filename) as tmp:
+        a_report.to_csv(tmp, encoding='utf-8', index=False)
+    print(f"{len(a_report)} employees absent at least once from {start} to {end} saved to {filename}")
+    return a_report
 
 # As Part 10 of Project
 def AbsentReport():
@@ -512,38 +2356,21 @@ def AbsentReport():
             year, month, day = inputdate()
             user_date = dt.date(year, month, day)
         
-            # finding the corresponding MG_YYYYMM.csv
-            csv_file = "MG_" + str(year) + str(month).zfill(2) + ".csv"
-            
-            files = []
-            for file in os.listdir(os.getcwd()):
-                files.append(file)
-    
-            found = []
-            for f in files:
-                if csv_file in f:
-                    found.append(1)
-                else:
-                    found.append(0)
-        
-            if any(found) == True:
+            # finding the corresponding MG_YYYYMM file
+            if mgexists(year, month) or BACKEND == 'bin':
                 break
             else:
                 print("Date is either not valid of file does not exist")
 
-    # get dataframe and merge both files based on TokenID
-    df_inout = pd.read_csv(csv_file)
-    df_ee = pd.read_csv("employees.csv")
-    df_ee['TokenID'] = df_ee['TokenID'].astype('object')
-    df_ee.drop_duplicates(keep='last', subset='EmployeeID', inplace=True)
-    dfM1 = pd.merge(df_ee, df_inout, left_on="TokenID", right_on="Token ID", how="outer")
-    # this will contain all employees with corrs TokenID scanned and employees w no Token recorded at work
+    absentreport(user_date)
 
-    # filter list of employees working on user input date
-    df2 = dfM1[dfM1["Date"] == str(user_date)]
 
+def absentreport(user_date):
+    """
+    Display and save the absentee report of a single day.
+    """
     # extract list of employees who are not working on user input date
-    data = df_ee[~df_ee.EmployeeID.isin(df2.EmployeeID)]
+    data = cachedreport('absent', user_date, user_date, lambda: absentees(user_date))
 
     # generation of absent report
     print("Absent List For {}".format(user_date))
@@ -554,7 +2381,367 @@ def AbsentReport():
         print(a_report.reset_index(drop=True))
     else:
         print("There are no absentees today")
-    a_report.to_csv(filename, encoding='utf-8', index=False)
+    with atomicpath(filename) as tmp:
+        a_report.to_csv(tmp, encoding='utf-8', index=False)
+
+
+def overtimematrix(matrix):
+    """
+    The overtime rows of overtime() from an attendance matrix, in date and EmployeeID order.
+    """
+    qualifies = matrix['present'] & (matrix['worked'] >= (9 * 60) + 15)
+    rows, columns = np.nonzero(qualifies)
+    worked = matrix['worked'][rows, columns].astype(np.int64)
+    df_ee = matrix['employees']
+    dfm = pd.DataFrame({'Date': np.array([str(day) for day in matrix['days']], dtype=object)[columns],
+                        'EmployeeID': df_ee['EmployeeID'].to_numpy()[rows], 'Name': df_ee['Name'].to_numpy()[rows],
+                        'Work': [f"{hours} Hours {mins} Mins " for hours, mins in zip(worked // 60, worked % 60)],
+                        'Overtime in mins': worked - (9 * 60)})
+    return dfm.sort_values(['Date', 'EmployeeID'], kind='stable').reset_index(drop=True)
+
+
+def employeetotals(matrix):
+    """
+    Per employee: days present and absent, total and average worked minutes, overtime minutes and days.
+    """
+    present = matrix['present']
+    worked = np.where(present, matrix['worked'], 0).astype(np.int64)
+    overtime = np.where(worked >= (9 * 60) + 15, worked - (9 * 60), 0)
+    totals = matrix['employees'][['EmployeeID', 'Name']].copy()
+    totals['Days present'] = present.sum(axis=1)
+    totals['Days absent'] = (~present & matrix['merged']).sum(axis=1)
+    totals['Worked mins'] = worked.sum(axis=1)
+    totals['Average worked mins'] = (totals['Worked mins'] / totals['Days present'].where(totals['Days present'] > 0)).round(1)
+    totals['Overtime mins'] = overtime.sum(axis=1)
+    totals['Days with OT'] = (overtime > 0).sum(axis=1)
+    return totals
+
+
+def latearrivals(matrix, threshold='08:30'):
+    """
+    Boolean employees x days matrix of scan-ins after threshold (HH:MM); defaulted scan-ins are not counted.
+    """
+    cutoff = int(threshold[:2]) * 60 + int(threshold[3:5])
+    return matrix['present'] & ~matrix['noin'] & (matrix['in'] > cutoff)
+
+
+def rollingsum(values, window):
+    """
+    Sum of each row of an employees x days array over the last window days, ending on each day.
+    The first window - 1 days sum over the days available.
+    """
+    if window < 1:
+        raise ValueError(f"window must be at least 1 day, not {window}")
+    total = np.cumsum(values, axis=1, dtype=np.int32)
+    total[:, window:] = total[:, window:] - total[:, :-window]
+    return total
+
+
+def weeklyabsence(matrix):
+    """
+    Share of employee-days absent in each ISO week of the matrix (partial weeks count their days only).
+    Days of months not merged yet are left out, weeks without merged days are not listed.
+    """
+    merged = matrix['merged']
+    weeks = [f"{day.isocalendar()[0]}-W{day.isocalendar()[1]:02d}" for day in matrix['days']]
+    absent = (~matrix['present'][:, merged]).sum(axis=0)
+    rates = (pd.DataFrame({'Week': np.array(weeks, dtype=object)[merged], 'Absent': absent, 'Days': 1})
+             .groupby('Week', sort=True).sum())
+    rates['Absence rate'] = (rates['Absent'] / (rates['Days'] * max(len(matrix['employees']), 1))).round(4)
+    return rates[['Absence rate']].reset_index()
+
+
+def AnalyticsReport(start, end, threshold='08:30', window=7):
+    """
+    HR analytics from start to end (inclusive) from one attendance matrix: per employee totals, late
+    arrivals after threshold and the most absences within any window days; plus absence rates by week.
+    :return: Returns csv files Analytics_report_<start>_<end>.csv and Weekly_absence_<start>_<end>.csv
+    :rtype: csv file
+    """
+    matrix = attendancematrix(start, end)
+    with stage('report.analytics') as s:
+        report = employeetotals(matrix)
+        late = latearrivals(matrix, threshold)
+        report['Late days'] = late.sum(axis=1)
+        minuteslate = np.where(late, matrix['in'] - (int(threshold[:2]) * 60 + int(threshold[3:5])), 0).sum(axis=1)
+        report['Average mins late'] = (minuteslate / report['Late days'].where(report['Late days'] > 0)).round(1)
+        report[f"Most absences in {window} days"] = rollingsum(~matrix['present'] & matrix['merged'], window).max(axis=1, initial=0)
+        weekly = weeklyabsence(matrix)
+        s.count(rows_in=matrix['present'].size, rows_out=len(report))
+
+    filename = f"Analytics_report_{start}_{end}.csv"
+    with atomicpath(filename) as tmp:
+        report.to_csv(tmp, encoding='utf-8', index=False)
+    with atomicpath(f"Weekly_absence_{start}_{end}.csv") as tmp:
+        weekly.to_csv(tmp, encoding='utf-8', index=False)
+    print(f"Analytics for {len(report)} employees from {start} to {end} saved to {filename} "
+          f"and Weekly_absence_{start}_{end}.csv")
+    return report, weekly
+
+
+def importtimes():
+    """
+    Report how long this script took to import and which heavy modules were loaded on first use.
+    """
+    lines = [f"startup {IMPORTTIMES['main']:.3f}s"]
+    lines += [f"{name} {seconds:.3f}s (first use)" for name, seconds in IMPORTTIMES.items() if name != 'main']
+    return ', '.join(lines)
+
+
+def yearmonth(text):
+    """
+    Parse YYYY-MM for the command line, returns the first day of the month.
+    """
+    if len(text) != 7 or text[4:5] != '-' or not validdate(text[:4], text[5:], '1'):
+        raise argparse.ArgumentTypeError(f"{text} is not a valid year-month (YYYY-MM)")
+    return dt.date(int(text[:4]), int(text[5:]), 1)
+
+
+def isodate(text):
+    """
+    Parse YYYY-MM-DD for the command line.
+    """
+    if len(text) != 10 or not validdate(text[0:4], text[5:7], text[8:]):
+        raise argparse.ArgumentTypeError(f"{text} is not a valid date (YYYY-MM-DD)")
+    return dt.date(int(text[0:4]), int(text[5:7]), int(text[8:]))
+
+
+def hhmm(text):
+    """
+    Check HH:MM for the command line.
+    """
+    if len(text) != 5 or text[2:3] != ':' or not validtime(text[:2], text[3:]):
+        raise argparse.ArgumentTypeError(f"{text} is not a valid time (HH:MM)")
+    return text
+
+
+def positive(text):
+    """
+    Parse a whole number of at least 1 for the command line.
+    """
+    if not text.isdigit() or int(text) < 1:
+        raise argparse.ArgumentTypeError(f"{text} is not a whole number of at least 1")
+    return int(text)
+
+
+def seconds(text):
+    """
+    Parse a number of seconds above 0 for the command line.
+    """
+    try:
+        value = float(text)
+    except ValueError:
+        value = 0.0
+    if not 0 < value < float('inf'):
+        raise argparse.ArgumentTypeError(f"{text} is not a number of seconds above 0")
+    return value
+
+
+def cliscan(args):
+    print(f"{BulkScan(args.file, args.flush_size, args.flush_interval)} scans recorded")
+
+
+def cliprofile(args):
+    csvName = employeesfile()
+    newprofile(args.id, csvName, args.name.capitalize(), args.mobile, args.email, args.token)
+
+
+def cliprofiles(args):
+    written, rejected = UpsertProfiles(args.file, employeesfile())
+    print(f"{written} profiles added or updated, {len(rejected)} rejected")
+    if len(rejected) > 0:
+        print(rejected[['EmployeeID', 'TokenID', 'Problem']].to_string(index=False))
+
+
+def climerge(args):
+    months = args.month or []
+    if args.start is not None:
+        month = args.start
+        while month <= (args.end or args.start):
+            months.append(month)
+            month = (month + dt.timedelta(days=31)).replace(day=1)
+    if args.incremental:
+        for month in months:
+            days = MergeIncremental(month.year, month.month)
+            print(f"{month:%Y-%m}: " + ("month rebuilt" if days is None else f"{len(days)} days refreshed"))
+    else:
+        # each run of consecutive months is merged in one pass, months in between are left alone
+        runs = []
+        for month in sorted(set(months)):
+            if runs and (runs[-1][1] + dt.timedelta(days=31)).replace(day=1) == month:
+                runs[-1][1] = month
+            else:
+                runs.append([month, month])
+        written = []
+        for first, last in runs:
+            written.extend(MergeRange(first, last, workers=args.workers, shifts=args.shifts, budget=args.budget))
+        print(*written, sep='\n')
+
+
+def cliovertime(args):
+    if args.end is None or args.end == args.start:
+        overtimereport(args.start)
+    else:
+        OverTimeRange(args.start, args.end)
+
+
+def cliabsent(args):
+    if args.date is not None:
+        absentreport(args.date)
+    else:
+        AbsentRange(args.start, args.end or args.start)
+
+
+def clianalytics(args):
+    AnalyticsReport(args.start, args.end, args.late, args.window)
+
+
+def cliserve(args):
+    ScanServer(args.host, args.port, args.socket)
+
+
+def cliindex(args):
+    if args.build:
+        print(f"{BuildIndex()} entries indexed")
+    if args.token is not None:
+        first, last = lookupscan(args.token, args.date)
+        print(f"Token {args.token} on {args.date}: in {first or '-'}, out {last or '-'}")
+
+
+def clidatabase(args):
+    scans, employees = ImportDatabase(source=args.source)
+    print(f"{scans} scans and {employees} employees imported into {DATABASE}")
+
+
+def clibinlog(args):
+    try:
+        print(f"{ConvertToBinlog(merge=args.merge)} scans converted")
+    except FileExistsError as error:
+        sys.exit(f"{error}, run binlog --merge to keep them")
+
+
+def cliparser():
+    """
+    Argument parser for one command line action.
+    """
+    parser = argparse.ArgumentParser(
+        prog='main.py',
+        description="Factory attendance without the menu. Chain several actions in one run by separating them with '+'.",
+        epilog="example: python main.py merge --month 2021-05 + overtime --from 2021-05-01 --to 2021-05-31")
+    parser.add_argument('--time', action='store_true', help="print how long the action took")
+    parser.add_argument('--metrics', metavar='TARGET',
+                        help="record stage timings and counters: 'log' for JSON lines on stderr, or a .prom / .json file")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scan = commands.add_parser('scan', help="record scans from a file or stdin (Token ID,YYYY-MM-DD,HH:MM per line)")
+    scan.add_argument('file', nargs='?', help="scan file, stdin when omitted")
+    scan.add_argument('--flush-size', type=positive, default=1000, help="scans buffered before writing")
+    scan.add_argument('--flush-interval', type=seconds, default=5.0, help="seconds between writes")
+    scan.set_defaults(run=cliscan)
+
+    profile = commands.add_parser('profile', help="add or update an employee profile")
+    profile.add_argument('--id', required=True, type=str.capitalize, help="employee ID (S+4-digit)")
+    profile.add_argument('--name', required=True)
+    profile.add_argument('--mobile', required=True, help="8 digits beginning with '8' or '9'")
+    profile.add_argument('--email', required=True)
+    profile.add_argument('--token', required=True, help="4-digit Token ID")
+    profile.set_defaults(run=cliprofile)
+
+    profiles = commands.add_parser('profiles', help="add or update many profiles from a csv or jsonl file")
+    profiles.add_argument('file', help="rows with EmployeeID,Name,MobileNumber,EMail,TokenID")
+    profiles.set_defaults(run=cliprofiles)
+
+    merge = commands.add_parser('merge', help="generate MG_YYYYMM files")
+    merge.add_argument('--month', type=yearmonth, action='append', help="month to merge (YYYY-MM), repeatable")
+    merge.add_argument('--from', dest='start', type=yearmonth, help="first month of a range (YYYY-MM)")
+    merge.add_argument('--to', dest='end', type=yearmonth, help="last month of a range (YYYY-MM)")
+    merge.add_argument('--incremental', action='store_true', help="only recompute days changed since the last merge")
+    merge.add_argument('--workers', type=int, help="processes used to parse daily files")
+    merge.add_argument('--budget', type=int, metavar='MB', help="stream the merge holding about this many MB of scans")
+    merge.add_argument('--shifts', choices=['day', 'overnight'], help="pair scans within a date or across midnight")
+    merge.set_defaults(run=climerge)
+
+    overtimecmd = commands.add_parser('overtime', help="overtime report for a day or a date range")
+    overtimecmd.add_argument('--from', dest='start', type=isodate, required=True, help="YYYY-MM-DD")
+    overtimecmd.add_argument('--to', dest='end', type=isodate, help="YYYY-MM-DD, same day when omitted")
+    overtimecmd.set_defaults(run=cliovertime)
+
+    absent = commands.add_parser('absent', help="absentee report for a day or a date range")
+    absent.add_argument('--date', type=isodate, help="YYYY-MM-DD")
+    absent.add_argument('--from', dest='start', type=isodate, help="YYYY-MM-DD")
+    absent.add_argument('--to', dest='end', type=isodate, help="YYYY-MM-DD")
+    absent.set_defaults(run=cliabsent)
+
+    analytics = commands.add_parser('analytics', help="per employee totals, late arrivals and weekly absence rates")
+    analytics.add_argument('--from', dest='start', type=isodate, required=True, help="YYYY-MM-DD")
+    analytics.add_argument('--to', dest='end', type=isodate, required=True, help="YYYY-MM-DD")
+    analytics.add_argument('--late', type=hhmm, default='08:30', help="scan-ins after this time (HH:MM) are late")
+    analytics.add_argument('--window', type=positive, default=7, help="days of the rolling absence window")
+    analytics.set_defaults(run=clianalytics)
+
+    serve = commands.add_parser('serve', help="accept scans from many terminals over TCP or a Unix socket")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=SCANPORT)
+    serve.add_argument('--socket', help="Unix socket path, instead of host and port")
+    serve.set_defaults(run=cliserve)
+
+    indexcmd = commands.add_parser('index', help="build the scan index or look up a token's scans on a day")
+    indexcmd.add_argument('--build', action='store_true', help="(re)build the index from the stored scans")
+    indexcmd.add_argument('--token', help="Token ID to look up")
+    indexcmd.add_argument('--date', type=isodate, default=dt.date.today(), help="YYYY-MM-DD, today when omitted")
+    indexcmd.set_defaults(run=cliindex)
+
+    database = commands.add_parser('database', help=f"import INOUT and employees.csv into {DATABASE}")
+    database.add_argument('--source', choices=['csv', 'bin'], default='csv', help="read scans from the daily files or the scan log")
+    database.set_defaults(run=clidatabase)
+
+    binlog = commands.add_parser('binlog', help="convert INOUT csv files into the binary scan log")
+    binlog.add_argument('--merge', action='store_true', help=f"keep the scans already in {BINLOG} and add the csv scans")
+    binlog.set_defaults(run=clibinlog)
+    return parser
+
+
+def cli(argv):
+    """
+    Run one or more actions non-interactively. Actions are separated by '+' and all of them are
+    checked before the first one runs.
+    """
+    parser = cliparser()
+    actions = [[]]
+    for arg in argv:
+        if arg == '+':
+            actions.append([])
+        else:
+            actions[-1].append(arg)
+
+    parsed = []
+    for action in actions:
+        args = parser.parse_args(action)
+        if args.command == 'merge' and not (args.month or args.start):
+            parser.error("merge needs --month or --from")
+        if args.command == 'absent' and args.date is None and args.start is None:
+            parser.error("absent needs --date or --from")
+        if args.command == 'profile':
+            problem = profileerror(args.id, args.mobile, args.email, args.token)
+            if problem:
+                parser.error(problem)
+        parsed.append(args)
+
+    for args in parsed:
+        if args.metrics and args.metrics != METRICS:
+            enablemetrics(args.metrics)
+        started = time.perf_counter()
+        args.run(args)
+        if args.time:
+            print(f"{args.command} took {time.perf_counter() - started:.3f}s", file=sys.stderr)
+    if any(args.time for args in parsed):
+        print(f"Import time: {importtimes()}", file=sys.stderr)
+
+
+IMPORTTIMES['main'] = time.perf_counter() - STARTED
 
 if __name__=='__main__':
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        cli(sys.argv[1:])
+    else:
+        main()